@@ -25,6 +25,12 @@ def main() -> None:
         print(f"  - Relevant: {', '.join(res['relevant'])}")
         print()
 
+    cache = result["query_cache"]
+    print(
+        f"Query embedding cache: {cache['hits']} hits, "
+        f"{cache['disk_hits']} disk hits, {cache['misses']} misses"
+    )
+
 
 if __name__ == "__main__":
     main()
@@ -6,6 +6,7 @@ from lib.hybrid_search import (
     weighted_search_command,
 )
 from lib.evaluate import LLM_evaluate
+from lib.search_utils import ENCODER_BACKENDS, ONNX_THREADS, RESCORE_SOURCES
 
 
 def main() -> None:
@@ -32,6 +33,12 @@ def main() -> None:
     weighted_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    weighted_parser.add_argument(
+        "--rescore",
+        type=str,
+        choices=RESCORE_SOURCES,
+        help="Leg whose candidates are the only ones the other leg scores",
+    )
 
     rrf_parser = subparsers.add_parser(
         "rrf-search", help="Perform Reciprocal Rank Fusion search"
@@ -55,12 +62,32 @@ def main() -> None:
         choices=["individual", "batch", "cross_encoder"],
         help="Reranking method",
     )
+    rrf_parser.add_argument(
+        "--rerank-backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default="torch",
+        help="Inference backend for the cross_encoder reranking method",
+    )
+    rrf_parser.add_argument(
+        "--rerank-onnx-threads",
+        type=int,
+        default=ONNX_THREADS,
+        help="ONNX Runtime intra-op threads for an onnx --rerank-backend; "
+        "0 lets it decide",
+    )
     rrf_parser.add_argument(
         "--evaluate", action="store_true", help="Use an LLM to evaluate the results"
     )
     rrf_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    rrf_parser.add_argument(
+        "--rescore",
+        type=str,
+        choices=RESCORE_SOURCES,
+        help="Leg whose candidates are the only ones the other leg scores",
+    )
 
     args = parser.parse_args()
 
@@ -70,7 +97,9 @@ def main() -> None:
             for score in normalized:
                 print(f"* {score:.4f}")
         case "weighted-search":
-            result = weighted_search_command(args.query, args.alpha, args.limit)
+            result = weighted_search_command(
+                args.query, args.alpha, args.limit, args.rescore
+            )
 
             print(
                 f"Weighted Hybrid Search Results for '{result['query']}' (alpha={result['alpha']}):"
@@ -95,6 +124,9 @@ def main() -> None:
                 args.enhance,
                 args.rerank_method,
                 args.limit,
+                args.rerank_backend,
+                args.rescore,
+                args.rerank_onnx_threads,
             )
 
             if result["enhanced_query"]:
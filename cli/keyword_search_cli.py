@@ -3,26 +3,98 @@
 import argparse
 
 from lib.keyword_search import (
+    add_command,
+    analyzer_benchmark_command,
+    bm25_batch_benchmark_command,
+    bm25_benchmark_command,
     bm25_idf_command,
     bm25_tf_command,
     bm25search_command,
+    build_benchmark_command,
     build_command,
+    delete_command,
     idf_command,
+    merge_command,
+    proximity_search_command,
     search_command,
     tf_command,
     tfidf_command,
+    update_command,
+)
+from lib.search_utils import (
+    BM25_B,
+    BM25_K1,
+    BM25_MODES,
+    DEFAULT_BM25_MODE,
+    DEFAULT_BUILD_WORKERS,
+    DEFAULT_SEARCH_LIMIT,
+    PARALLEL_BUILD_MIN_DOCS,
+    PROXIMITY_WINDOW,
 )
-from lib.search_utils import BM25_B, BM25_K1
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build the inverted index")
+    build_parser = subparsers.add_parser("build", help="Build the inverted index")
+    build_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_BUILD_WORKERS,
+        help="Number of processes that index shards of the catalog; catalogs "
+        f"under {PARALLEL_BUILD_MIN_DOCS} documents are indexed in one",
+    )
+    build_parser.add_argument(
+        "--positions",
+        action="store_true",
+        help="Also index term positions for proximity and phrase search",
+    )
+
+    buildbench_parser = subparsers.add_parser(
+        "buildbench", help="Time index builds across worker counts"
+    )
+    buildbench_parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Worker counts to compare",
+    )
 
-    search_parser = subparsers.add_parser("search", help="Search movies using BM25")
-    search_parser.add_argument("query", type=str, help="Search query")
+    for name, help_text in (
+        ("add", "Add a movie to the index without rebuilding it"),
+        ("update", "Replace an indexed movie without rebuilding the index"),
+    ):
+        doc_parser = subparsers.add_parser(name, help=help_text)
+        doc_parser.add_argument("doc_id", type=int, help="Document ID")
+        doc_parser.add_argument("title", type=str, help="Movie title")
+        doc_parser.add_argument("description", type=str, help="Movie description")
+
+    delete_parser = subparsers.add_parser(
+        "delete", help="Delete a movie from the index without rebuilding it"
+    )
+    delete_parser.add_argument("doc_id", type=int, help="Document ID")
+
+    subparsers.add_parser(
+        "merge", help="Compact index updates into a single index segment"
+    )
+
+    search_parser = subparsers.add_parser(
+        "search", help="Search movies with a boolean keyword query"
+    )
+    search_parser.add_argument(
+        "query",
+        type=str,
+        help="Search query; combine terms with AND, OR, NOT and parentheses, "
+        "or leave the operators out to match any term",
+    )
+    search_parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Number of results to return",
+    )
 
     tf_parser = subparsers.add_parser(
         "tf", help="Get term frequency for a given document ID and term"
@@ -64,17 +136,113 @@ def main() -> None:
         "bm25search", help="Search movies using full BM25 scoring"
     )
     bm25search_parser.add_argument("query", type=str, help="Search query")
+    bm25search_parser.add_argument(
+        "--mode",
+        type=str,
+        choices=BM25_MODES,
+        default=DEFAULT_BM25_MODE,
+        help="Score every matching document or prune with score upper bounds",
+    )
+    bm25search_parser.add_argument(
+        "--filter",
+        type=str,
+        help="Only rank movies matching this AND/OR/NOT query",
+    )
+
+    proximity_parser = subparsers.add_parser(
+        "proximitysearch",
+        help="Search movies using BM25 boosted by query term proximity",
+    )
+    proximity_parser.add_argument("query", type=str, help="Search query")
+    proximity_parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Number of results to return",
+    )
+    proximity_parser.add_argument(
+        "--window",
+        type=int,
+        default=PROXIMITY_WINDOW,
+        help="Largest token distance between query terms that earns a boost",
+    )
+    proximity_parser.add_argument(
+        "--phrase",
+        action="store_true",
+        help="Only return movies containing the query as an exact phrase",
+    )
+
+    bm25bench_parser = subparsers.add_parser(
+        "bm25bench", help="Compare exhaustive and pruned BM25 retrieval"
+    )
+    bm25bench_parser.add_argument(
+        "queries",
+        type=str,
+        nargs="*",
+        help="Queries to run (default: the golden dataset queries)",
+    )
+    bm25bench_parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Number of results to retrieve per query",
+    )
+    bm25bench_parser.add_argument(
+        "--repeat", type=int, default=3, help="Times to run each query"
+    )
+
+    bm25batchbench_parser = subparsers.add_parser(
+        "bm25batchbench", help="Compare per-query and batched BM25 ranking"
+    )
+    bm25batchbench_parser.add_argument(
+        "queries",
+        type=str,
+        nargs="*",
+        help="Queries to run (default: the golden dataset queries)",
+    )
+    bm25batchbench_parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Number of results to retrieve per query",
+    )
+    bm25batchbench_parser.add_argument(
+        "--repeat", type=int, default=10, help="Times the query list is repeated"
+    )
+
+    analyzerbench_parser = subparsers.add_parser(
+        "analyzerbench", help="Compare per-call and batch tokenization of the catalog"
+    )
+    analyzerbench_parser.add_argument(
+        "--repeat", type=int, default=1, help="Times to tokenize the catalog"
+    )
 
     args = parser.parse_args()
 
     match args.command:
         case "build":
             print("Building inverted index...")
-            build_command()
+            build_command(args.workers, args.positions)
             print("Inverted index built successfully.")
+        case "add":
+            add_command(args.doc_id, args.title, args.description)
+            print(f"Added document {args.doc_id}.")
+        case "update":
+            update_command(args.doc_id, args.title, args.description)
+            print(f"Updated document {args.doc_id}.")
+        case "delete":
+            delete_command(args.doc_id)
+            print(f"Deleted document {args.doc_id}.")
+        case "merge":
+            merge_command()
+            print("Index segments merged successfully.")
         case "search":
             print("Searching for:", args.query)
-            results = search_command(args.query)
+            try:
+                results = search_command(args.query, args.limit)
+            except ValueError as e:
+                print(f"Invalid query: {e}")
+                return
             for i, res in enumerate(results, 1):
                 print(f"{i}. ({res['id']}) {res['title']}")
         case "tf":
@@ -98,9 +266,57 @@ def main() -> None:
             )
         case "bm25search":
             print("Searching for:", args.query)
-            results = bm25search_command(args.query)
+            results = bm25search_command(
+                args.query, mode=args.mode, filter_query=args.filter
+            )
+            for i, res in enumerate(results, 1):
+                print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
+        case "proximitysearch":
+            print("Searching for:", args.query)
+            results = proximity_search_command(
+                args.query, args.limit, args.window, args.phrase
+            )
             for i, res in enumerate(results, 1):
                 print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
+        case "bm25bench":
+            result = bm25_benchmark_command(args.queries, args.limit, args.repeat)
+            print(f"Queries: {result['queries']}, limit: {result['limit']}")
+            for mode, ms in result["timings_ms"].items():
+                print(f"  {mode}: {ms:.2f} ms/query")
+            print(f"  speedup: {result['speedup']:.2f}x")
+            if result["mismatches"]:
+                print(f"  mismatched queries: {', '.join(result['mismatches'])}")
+            else:
+                print("  pruned results match exhaustive results")
+        case "bm25batchbench":
+            result = bm25_batch_benchmark_command(args.queries, args.limit, args.repeat)
+            print(f"Queries: {result['queries']}, limit: {result['limit']}")
+            print(f"  matrix build: {result['matrix_seconds']:.2f} s")
+            print(f"  per-query: {result['per_query_qps']:.1f} queries/s")
+            print(f"  batched:   {result['batch_qps']:.1f} queries/s")
+            print(f"  speedup: {result['speedup']:.2f}x")
+            if result["mismatches"]:
+                print(f"  mismatched queries: {', '.join(result['mismatches'])}")
+            else:
+                print("  batched results match per-query results")
+        case "buildbench":
+            result = build_benchmark_command(args.workers)
+            print(f"Documents: {result['documents']}")
+            for workers, seconds in result["timings_seconds"].items():
+                speedup = result["speedups"][workers]
+                print(f"  {workers} workers: {seconds:.2f} s ({speedup:.2f}x)")
+            print(f"  identical indexes: {result['identical']}")
+            print(
+                "  build uses workers from "
+                f"{result['parallel_min_docs']} documents up"
+            )
+        case "analyzerbench":
+            result = analyzer_benchmark_command(args.repeat)
+            print(f"Documents: {result['documents']}, tokens: {result['tokens']}")
+            print(f"  per-call: {result['per_call_seconds']:.2f} s")
+            print(f"  batch:    {result['batch_seconds']:.2f} s")
+            print(f"  speedup:  {result['speedup']:.1f}x")
+            print(f"  identical tokens: {result['identical']}")
         case _:
             parser.exit(2, parser.format_help())
 
@@ -0,0 +1,205 @@
+import re
+import sys
+from collections.abc import Callable, Container, Sequence
+
+from .postings import gallop
+
+# returned by a matcher once it has no documents left
+NO_MORE_DOCS = sys.maxsize
+
+OPERATORS = ("AND", "OR", "NOT")
+_QUERY_TOKEN = re.compile(r"[()]|[^\s()]+")
+
+# ("term", word) | ("not", node) | ("and", [nodes]) | ("or", [nodes])
+QueryNode = tuple
+
+
+def has_boolean_syntax(query: str) -> bool:
+    """Whether `query` uses an upper case operator.
+
+    Parentheses alone don't count, so a title like "Rocky (1976)" stays an
+    ordinary query.
+    """
+    return any(token in OPERATORS for token in _QUERY_TOKEN.findall(query))
+
+
+def parse_boolean_query(query: str) -> QueryNode:
+    """Parse AND, OR, NOT and parentheses; adjacent terms are OR-ed.
+
+    NOT binds tightest, then AND, then OR. Operators must be upper case, so
+    a lower case "and" or "not" is an ordinary (stop)word.
+    """
+    tokens = _QUERY_TOKEN.findall(query)
+    node, end = _parse_or(tokens, 0)
+    if end < len(tokens):
+        raise ValueError(f"unexpected '{tokens[end]}' in query")
+    return node
+
+
+def _parse_or(tokens: list[str], i: int) -> tuple[QueryNode, int]:
+    node, i = _parse_and(tokens, i)
+    children = [node]
+    while i < len(tokens) and tokens[i] != ")":
+        if tokens[i] == "OR":
+            i += 1
+        node, i = _parse_and(tokens, i)
+        children.append(node)
+    return (children[0] if len(children) == 1 else ("or", children)), i
+
+
+def _parse_and(tokens: list[str], i: int) -> tuple[QueryNode, int]:
+    node, i = _parse_unary(tokens, i)
+    children = [node]
+    while i < len(tokens) and tokens[i] == "AND":
+        node, i = _parse_unary(tokens, i + 1)
+        children.append(node)
+    return (children[0] if len(children) == 1 else ("and", children)), i
+
+
+def _parse_unary(tokens: list[str], i: int) -> tuple[QueryNode, int]:
+    if i >= len(tokens):
+        raise ValueError("query ends where a term was expected")
+    token = tokens[i]
+    if token == "NOT":
+        node, i = _parse_unary(tokens, i + 1)
+        return ("not", node), i
+    if token == "(":
+        node, i = _parse_or(tokens, i + 1)
+        if i >= len(tokens) or tokens[i] != ")":
+            raise ValueError("unbalanced parentheses in query")
+        return node, i + 1
+    if token in OPERATORS or token == ")":
+        raise ValueError(f"unexpected '{token}' in query")
+    return ("term", token), i + 1
+
+
+class TermMatcher:
+    def __init__(self, ordinals: Sequence[int]) -> None:
+        self.ordinals = ordinals
+        self.position = 0
+        self.cost = len(ordinals)
+
+    def advance(self, target: int) -> int:
+        self.position = gallop(self.ordinals, target, self.position)
+        if self.position < len(self.ordinals):
+            return self.ordinals[self.position]
+        return NO_MORE_DOCS
+
+
+class AllMatcher:
+    """Every live document, for queries that only exclude."""
+
+    def __init__(self, doc_count: int, deleted: Container[int]) -> None:
+        self.doc_count = doc_count
+        self.deleted = deleted
+        self.cost = doc_count
+
+    def advance(self, target: int) -> int:
+        while target < self.doc_count and target in self.deleted:
+            target += 1
+        return target if target < self.doc_count else NO_MORE_DOCS
+
+
+class AndMatcher:
+    """Leapfrog intersection of `required`, minus anything in `excluded`.
+
+    The cheapest matcher proposes candidates and the others skip ahead to
+    them, so the walk is bounded by the rarest term.
+    """
+
+    def __init__(self, required: list, excluded: list) -> None:
+        self.required = sorted(required, key=lambda matcher: matcher.cost)
+        self.excluded = excluded
+        self.cost = self.required[0].cost
+        self.doc = -1
+
+    def advance(self, target: int) -> int:
+        # children only move forward, so a target behind the current match
+        # must not be re-evaluated against them
+        if target <= self.doc:
+            return self.doc
+        candidate = target
+        while candidate != NO_MORE_DOCS:
+            candidate = self.required[0].advance(candidate)
+            for matcher in self.required[1:]:
+                found = matcher.advance(candidate)
+                if found != candidate:
+                    candidate = found
+                    break
+            else:
+                if candidate == NO_MORE_DOCS or not any(
+                    matcher.advance(candidate) == candidate for matcher in self.excluded
+                ):
+                    break
+                candidate += 1
+        self.doc = candidate
+        return candidate
+
+
+class OrMatcher:
+    def __init__(self, matchers: list) -> None:
+        self.matchers = matchers
+        self.cost = sum(matcher.cost for matcher in matchers)
+        self.doc = -1
+
+    def advance(self, target: int) -> int:
+        if target > self.doc:
+            self.doc = min(matcher.advance(target) for matcher in self.matchers)
+        return self.doc
+
+
+def compile_boolean_query(
+    node: QueryNode,
+    term_postings: Callable[[str], list[Sequence[int]]],
+    all_docs: Callable[[], AllMatcher],
+):
+    """Build the matcher for a parsed query.
+
+    `term_postings` maps a query word to the sorted ordinals of each token it
+    analyzes to; a word that analyzes to nothing (a stopword) constrains
+    nothing and is dropped, and negating it excludes nothing, so matches
+    every document. Returns None when nothing is left to match.
+    """
+    kind = node[0]
+    if kind == "term":
+        matchers = [TermMatcher(ordinals) for ordinals in term_postings(node[1])]
+        if len(matchers) > 1:
+            return AndMatcher(matchers, [])
+        return matchers[0] if matchers else None
+    if kind == "not":
+        excluded = compile_boolean_query(node[1], term_postings, all_docs)
+        if excluded is None:
+            return all_docs()
+        return AndMatcher([all_docs()], [excluded])
+
+    children = node[1]
+    if kind == "or":
+        matchers = [
+            matcher
+            for matcher in (
+                compile_boolean_query(child, term_postings, all_docs)
+                for child in children
+            )
+            if matcher is not None
+        ]
+        if len(matchers) > 1:
+            return OrMatcher(matchers)
+        return matchers[0] if matchers else None
+
+    required, excluded = [], []
+    for child in children:
+        if child[0] == "not":
+            matcher = compile_boolean_query(child[1], term_postings, all_docs)
+            if matcher is not None:
+                excluded.append(matcher)
+            else:
+                required.append(all_docs())
+        else:
+            matcher = compile_boolean_query(child, term_postings, all_docs)
+            if matcher is not None:
+                required.append(matcher)
+    if not required and not excluded:
+        return None
+    if not excluded and len(required) == 1:
+        return required[0]
+    return AndMatcher(required or [all_docs()], excluded)
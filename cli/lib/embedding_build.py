@@ -0,0 +1,220 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .model_registry import get_sentence_transformer
+from .search_utils import (
+    DEFAULT_EMBED_WORKERS,
+    EMBED_BATCH_SIZE,
+    EMBEDDING_CACHE_DTYPE,
+)
+from .vector_index import ROW_BATCH_SIZE, load_embeddings, normalize_embeddings
+
+FINGERPRINT_SIZE = 16
+
+
+class EmbeddingEncoder:
+    """Encodes batches of texts in this process or in a pool of workers.
+
+    Each worker process loads its own copy of the model. Workers are
+    spawned rather than forked, because the parent may already hold a torch
+    model, and forking its thread pools can deadlock the children. At most
+    two batches per worker are in flight, so memory stays bounded however
+    many batches there are.
+    """
+
+    def __init__(self, model_name: str, workers: int = DEFAULT_EMBED_WORKERS) -> None:
+        self.model_name = model_name
+        self.workers = workers
+
+    def encode_batches(
+        self, batches: Iterable[tuple[int, list[str]]]
+    ) -> Iterator[tuple[int, np.ndarray]]:
+        """(batch index, vectors) for each (batch index, texts), as finished."""
+        if self.workers <= 1:
+            model = get_sentence_transformer(self.model_name)
+            for i, texts in batches:
+                yield i, model.encode(texts)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_worker_model,
+            initargs=(self.model_name,),
+        ) as pool:
+            pending = set()
+            for i, texts in batches:
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(_encode_batch, self.model_name, i, texts))
+            for future in pending:
+                yield future.result()
+
+
+def fingerprint_texts(texts: Iterable[str]) -> np.ndarray:
+    """A BLAKE2b digest of each text, one row of FINGERPRINT_SIZE bytes per text."""
+    digests = b"".join(
+        hashlib.blake2b(text.encode(), digest_size=FINGERPRINT_SIZE).digest()
+        for text in texts
+    )
+    return np.frombuffer(digests, dtype=np.uint8).reshape(-1, FINGERPRINT_SIZE)
+
+
+def fingerprints_path(path: str) -> str:
+    """Where the text fingerprints of the embeddings saved at `path` are kept."""
+    return f"{os.path.splitext(path)[0]}.fingerprints.npy"
+
+
+def update_embeddings(
+    path: str,
+    texts: Iterable[str],
+    encoder: EmbeddingEncoder,
+    dtype: str | None = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    fingerprints: np.ndarray | None = None,
+) -> np.ndarray:
+    """The embeddings cache at `path`, brought up to date with `texts`.
+
+    Cached rows are matched to texts by fingerprint, so only new or changed
+    texts are encoded; an up-to-date cache is returned without rewriting it.
+    Rows are written straight into a preallocated memory-mapped file as
+    batches finish, and finished batches are checkpointed, so an interrupted
+    build picks up where it stopped.
+
+    `texts` is iterated once to fingerprint it, unless `fingerprints` are
+    given, and once more to read the texts to encode a batch at a time, so
+    it can regenerate them on each pass instead of holding them all.
+    """
+    if fingerprints is None:
+        fingerprints = fingerprint_texts(texts)
+    row_count = len(fingerprints)
+    if not row_count:
+        raise ValueError("cannot build embeddings without any texts")
+    fingerprint_path = fingerprints_path(path)
+    embeddings = None
+    cached_rows = {}
+    if os.path.exists(path) and os.path.exists(fingerprint_path):
+        embeddings = load_embeddings(path, dtype)
+        cached_fingerprints = np.load(fingerprint_path)
+        if len(cached_fingerprints) == len(embeddings):
+            if np.array_equal(cached_fingerprints, fingerprints):
+                return embeddings
+            for row, fingerprint in enumerate(cached_fingerprints):
+                cached_rows[fingerprint.tobytes()] = row
+        else:
+            embeddings = None
+
+    if dtype is None:
+        dtype = embeddings.dtype if embeddings is not None else EMBEDDING_CACHE_DTYPE
+    rows = np.array(
+        [cached_rows.get(fingerprint.tobytes(), -1) for fingerprint in fingerprints],
+        dtype=np.int64,
+    )
+    kept = np.flatnonzero(rows >= 0)
+    missing = np.flatnonzero(rows < 0)
+    batches = [
+        missing[start : start + batch_size]
+        for start in range(0, len(missing), batch_size)
+    ]
+
+    # a checkpoint only applies to a build of exactly these texts and rows
+    job = hashlib.blake2b(fingerprints.tobytes() + rows.tobytes()).hexdigest()
+    job += f":{np.dtype(dtype).name}"
+    partial_path = f"{path}.partial"
+    checkpoint_path = f"{path}.checkpoint.json"
+    output, done = _resume(partial_path, checkpoint_path, job, row_count)
+    if output is None and embeddings is not None:
+        output = _start_output(partial_path, row_count, embeddings.shape[1], dtype)
+        for start in range(0, len(kept), ROW_BATCH_SIZE):
+            block = kept[start : start + ROW_BATCH_SIZE]
+            output[block] = embeddings[rows[block]]
+        output.flush()
+        _write_json(checkpoint_path, {"job": job, "done": []})
+
+    todo = _read_batches(texts, batches, done)
+    for i, vectors in encoder.encode_batches(todo):
+        if output is None:
+            # nothing cached to copy: the first batch gives the dimension
+            output = _start_output(partial_path, row_count, vectors.shape[1], dtype)
+        output[batches[i]] = normalize_embeddings(vectors)
+        output.flush()
+        done.add(i)
+        _write_json(checkpoint_path, {"job": job, "done": sorted(done)})
+    del output
+
+    # drop the old fingerprints first, so a crash part way through can only
+    # cost a full re-encode, never pair fingerprints with the wrong rows
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
+    os.replace(partial_path, path)
+    tmp_path = f"{fingerprint_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, fingerprints)
+    os.replace(tmp_path, fingerprint_path)
+    os.remove(checkpoint_path)
+    return load_embeddings(path)
+
+
+def _read_batches(
+    texts: Iterable[str], batches: list[np.ndarray], done: set[int]
+) -> Iterator[tuple[int, list[str]]]:
+    """(batch index, texts) of each batch not yet done, in one pass over `texts`.
+
+    The encoder pulls batches as it has room for them, so only the texts of
+    batches in flight are held.
+    """
+    remaining = iter(texts)
+    position = 0
+    for i, batch in enumerate(batches):
+        batch_texts = []
+        for row in batch.tolist():
+            batch_texts.append(next(itertools.islice(remaining, row - position, None)))
+            position = row + 1
+        if i not in done:
+            yield i, batch_texts
+
+
+def _resume(
+    partial_path: str, checkpoint_path: str, job: str, row_count: int
+) -> tuple[np.ndarray | None, set[int]]:
+    if not (os.path.exists(partial_path) and os.path.exists(checkpoint_path)):
+        return None, set()
+    with open(checkpoint_path, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint["job"] != job:
+        return None, set()
+    output = np.lib.format.open_memmap(partial_path, mode="r+")
+    if len(output) != row_count:
+        return None, set()
+    return output, set(checkpoint["done"])
+
+
+def _start_output(path: str, row_count: int, dim: int, dtype: str) -> np.ndarray:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return np.lib.format.open_memmap(
+        path, mode="w+", dtype=dtype, shape=(row_count, dim)
+    )
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _load_worker_model(model_name: str) -> None:
+    get_sentence_transformer(model_name)
+
+
+def _encode_batch(model_name: str, i: int, texts: list[str]) -> tuple[int, np.ndarray]:
+    return i, get_sentence_transformer(model_name).encode(texts)
@@ -3,13 +3,11 @@ import os
 
 from dotenv import load_dotenv
 from google import genai
-from sentence_transformers import CrossEncoder
 
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=api_key)
 model = "gemini-2.0-flash"
-cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
 
 
 def LLM_evaluate(query: str, formatted_results: list[str]) -> list[int]:
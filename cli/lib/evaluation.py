@@ -39,6 +39,7 @@ def evaluate_command(limit: int = 5) -> dict:
     semantic_search = SemanticSearch()
     semantic_search.load_or_create_embeddings(movies)
     hybrid_search = HybridSearch(movies)
+    hybrid_search.warm_up()
 
     total_precision = 0
     results_by_query = {}
@@ -70,4 +71,5 @@ def evaluate_command(limit: int = 5) -> dict:
         "test_cases_count": len(test_cases),
         "limit": limit,
         "results": results_by_query,
+        "query_cache": hybrid_search.semantic_search.query_cache.stats(),
     }
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+import threading
 
 from .keyword_search import InvertedIndex
 from .query_enhancement import enhance_query
@@ -7,12 +7,18 @@ from .reranking import rerank
 from .search_utils import (
     DEFAULT_ALPHA,
     DEFAULT_SEARCH_LIMIT,
+    HYBRID_RESCORE_FACTOR,
+    HYBRID_SEARCH_FACTOR,
+    ONNX_THREADS,
+    RESCORE_SOURCES,
     RRF_K,
     SEARCH_MULTIPLIER,
+    WARM_UP_QUERY,
     format_search_result,
     load_movies,
 )
 from .semantic_search import ChunkedSemanticSearch
+from .vector_index import normalize_embeddings
 
 
 class HybridSearch:
@@ -21,25 +27,118 @@ class HybridSearch:
         self.semantic_search = ChunkedSemanticSearch()
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
-        self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
-            self.idx.build()
-            self.idx.save()
-
-    def _bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
-
-    def weighted_search(self, query: str, alpha: float, limit: int = 5) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+        # the keyword index stays loaded and is swapped for a freshly loaded
+        # one when a save changes it on disk; queries use whichever index
+        # they started with
+        self.idx = None
+        self.idx_version = None
+        self.idx_lock = threading.Lock()
+
+    def keyword_index(self) -> InvertedIndex:
+        if self.idx is not None and self.idx.disk_version() == self.idx_version:
+            return self.idx
+        with self.idx_lock:
+            idx = InvertedIndex()
+            version = idx.disk_version()
+            # another query may have reloaded it while this one waited
+            if self.idx is not None and version == self.idx_version:
+                return self.idx
+            if not os.path.exists(idx.index_path):
+                idx.build()
+                idx.save()
+                version = idx.disk_version()
+            else:
+                # loaded after reading the version, so a save in between only
+                # costs another reload
+                idx.load()
+            self.idx, self.idx_version = idx, version
+            return idx
+
+    def warm_up(self, query: str = WARM_UP_QUERY) -> None:
+        """Do the first query's one-off work ahead of it.
+
+        Loads the keyword index and the query model and runs `query` through
+        both legs, faulting in the chunk embeddings. The query embedding
+        skips the query cache, so every warm-up runs the model.
+        """
+        self._bm25_search(query, 1)
+        semantic_search = self.semantic_search
+        embedding = semantic_search.query_model.encode([query])
+        semantic_search.search_chunk_embeddings(normalize_embeddings(embedding), 1)
+
+    def _bm25_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        mode: str = "exhaustive",
+        candidates: list[int] | None = None,
+    ) -> list[dict]:
+        idx = self.keyword_index()
+        return idx.bm25_search(query, limit, mode, candidates=candidates)
+
+    def _search_legs(
+        self, query: str, limit: int, rescore: str | None = None
+    ) -> tuple[list[dict], list[dict]]:
+        """BM25 and semantic results to fuse.
+
+        By default both legs rank the whole corpus. With `rescore`, that leg
+        picks HYBRID_RESCORE_FACTOR * limit candidates and the other leg
+        scores only those, so the work per query is bound by the candidate
+        count rather than the corpus size. BM25 only picks documents that
+        match the query; with fewer than `limit` of them the semantic leg
+        scans every chunk.
+        """
+        if rescore is None:
+            search_limit = limit * HYBRID_SEARCH_FACTOR
+            bm25_results = self._bm25_search(query, search_limit)
+            semantic_results = self.semantic_search.search_chunks(query, search_limit)
+            return bm25_results, semantic_results
+
+        candidate_count = limit * HYBRID_RESCORE_FACTOR
+        if rescore == "bm25":
+            # BM25 pads its ranking with zero-score documents in catalogue
+            # order; those are no keyword match, so they aren't candidates
+            bm25_results = [
+                result
+                for result in self._bm25_search(query, candidate_count)
+                if result["score"] > 0
+            ]
+            if len(bm25_results) < limit:
+                # too few keyword matches to pick from: scan every chunk
+                semantic_results = self.semantic_search.search_chunks(
+                    query, candidate_count
+                )
+            else:
+                semantic_results = self.semantic_search.search_candidate_chunks(
+                    query, [result["id"] for result in bm25_results], candidate_count
+                )
+        elif rescore == "semantic":
+            semantic_results = self.semantic_search.search_chunks(
+                query, candidate_count
+            )
+            bm25_results = self._bm25_search(
+                query,
+                candidate_count,
+                candidates=[result["id"] for result in semantic_results],
+            )
+        else:
+            raise ValueError(
+                f"unknown rescore source '{rescore}', expected one of {RESCORE_SOURCES}"
+            )
+        return bm25_results, semantic_results
+
+    def weighted_search(
+        self, query: str, alpha: float, limit: int = 5, rescore: str | None = None
+    ) -> list[dict]:
+        bm25_results, semantic_results = self._search_legs(query, limit, rescore)
 
         combined = combine_search_results(bm25_results, semantic_results, alpha)
         return combined[:limit]
 
-    def rrf_search(self, query: str, k: int, limit: int = 10) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+    def rrf_search(
+        self, query: str, k: int, limit: int = 10, rescore: str | None = None
+    ) -> list[dict]:
+        bm25_results, semantic_results = self._search_legs(query, limit, rescore)
 
         fused = reciprocal_rank_fusion(bm25_results, semantic_results, k)
         return fused[:limit]
@@ -181,7 +280,10 @@ def reciprocal_rank_fusion(
 
 
 def weighted_search_command(
-    query: str, alpha: float = DEFAULT_ALPHA, limit: int = DEFAULT_SEARCH_LIMIT
+    query: str,
+    alpha: float = DEFAULT_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    rescore: str | None = None,
 ) -> dict:
     movies = load_movies()
     searcher = HybridSearch(movies)
@@ -189,7 +291,7 @@ def weighted_search_command(
     original_query = query
 
     search_limit = limit
-    results = searcher.weighted_search(query, alpha, search_limit)
+    results = searcher.weighted_search(query, alpha, search_limit, rescore)
 
     return {
         "original_query": original_query,
@@ -202,9 +304,12 @@ def weighted_search_command(
 def rrf_search_command(
     query: str,
     k: int = RRF_K,
-    enhance: Optional[str] = None,
-    rerank_method: Optional[str] = None,
+    enhance: str | None = None,
+    rerank_method: str | None = None,
     limit: int = DEFAULT_SEARCH_LIMIT,
+    rerank_backend: str = "torch",
+    rescore: str | None = None,
+    rerank_onnx_threads: int = ONNX_THREADS,
 ) -> dict:
     movies = load_movies()
     searcher = HybridSearch(movies)
@@ -216,11 +321,18 @@ def rrf_search_command(
         query = enhanced_query
 
     search_limit = limit * SEARCH_MULTIPLIER if rerank_method else limit
-    results = searcher.rrf_search(query, k, search_limit)
+    results = searcher.rrf_search(query, k, search_limit, rescore)
 
     reranked = False
     if rerank_method:
-        results = rerank(query, results, method=rerank_method, limit=limit)
+        results = rerank(
+            query,
+            results,
+            method=rerank_method,
+            limit=limit,
+            backend=rerank_backend,
+            onnx_threads=rerank_onnx_threads,
+        )
         reranked = True
 
     return {
@@ -0,0 +1,301 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterator, Mapping, Sequence
+
+import numpy as np
+
+from .postings import decode_positions, decode_postings_array
+
+SEGMENT_MAGIC = b"HOOPLAIX"
+SEGMENT_VERSION = 2
+SEGMENT_ALIGNMENT = 8
+
+# magic, format version, number of sections
+_HEADER = struct.Struct("<8sII")
+# section name, array typecode, byte offset, byte length
+_SECTION = struct.Struct("<16sc7xQQ")
+
+
+def write_segment(path: str, meta: dict, sections: dict[str, array | bytes]) -> None:
+    """Write a versioned segment file: header, section table, aligned sections.
+
+    Arrays keep their typecode so readers get typed views back. The file is
+    written next to `path` and moved into place, so readers never see a
+    partial segment.
+    """
+    payloads = [("meta", "B", json.dumps(meta).encode())]
+    for name, data in sections.items():
+        if isinstance(data, array):
+            payloads.append((name, data.typecode, data.tobytes()))
+        else:
+            payloads.append((name, "B", bytes(data)))
+
+    offset = _align(_HEADER.size + len(payloads) * _SECTION.size)
+    table = []
+    for name, typecode, payload in payloads:
+        table.append((name, typecode, offset, len(payload)))
+        offset = _align(offset + len(payload))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(table)))
+        for name, typecode, offset, length in table:
+            f.write(_SECTION.pack(name.encode(), typecode.encode(), offset, length))
+        for (_, _, offset, _), (_, _, payload) in zip(table, payloads):
+            f.seek(offset)
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IndexSegment:
+    """Read-only view of a segment file through mmap.
+
+    Opening only parses the header; section pages are faulted in on first
+    use and shared with every other process that maps the same file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, section_count = _HEADER.unpack_from(view)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+        if version != SEGMENT_VERSION:
+            raise ValueError(
+                f"{path} has segment version {version}, expected {SEGMENT_VERSION}; "
+                "rebuild the index"
+            )
+
+        self.sections: dict[str, memoryview] = {}
+        for i in range(section_count):
+            name, typecode, offset, length = _SECTION.unpack_from(
+                view, _HEADER.size + i * _SECTION.size
+            )
+            section = view[offset : offset + length]
+            self.sections[name.rstrip(b"\0").decode()] = section.cast(typecode.decode())
+        self.meta = json.loads(bytes(self.sections.pop("meta")))
+
+
+def encode_strings(strings: Sequence[str]) -> tuple[array, bytes]:
+    offsets = array("Q", [0])
+    data = bytearray()
+    for s in strings:
+        data += s.encode()
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+class StringTable(Sequence):
+    """Sequence of strings decoded on access from an offsets view and a blob."""
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self._data[self._offsets[i] : self._offsets[i + 1]], "utf-8")
+
+
+class DocOrdinals(Mapping):
+    """doc_id -> ordinal lookups by binary search over ids sorted at save time."""
+
+    def __init__(self, sorted_doc_ids: memoryview, ordinals: memoryview) -> None:
+        self._sorted_doc_ids = sorted_doc_ids
+        self._ordinals = ordinals
+
+    def __getitem__(self, doc_id: int) -> int:
+        i = bisect_left(self._sorted_doc_ids, doc_id)
+        if i < len(self._sorted_doc_ids) and self._sorted_doc_ids[i] == doc_id:
+            return self._ordinals[i]
+        raise KeyError(doc_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._sorted_doc_ids)
+
+    def __len__(self) -> int:
+        return len(self._sorted_doc_ids)
+
+
+class StoredDocuments(Mapping):
+    """doc_id -> document, parsed from the stored JSON fields on access.
+
+    Iterates in ordinal order, like the docmap it was written from.
+    """
+
+    def __init__(
+        self, doc_ids: memoryview, doc_ordinals: DocOrdinals, stored: StringTable
+    ) -> None:
+        self._doc_ids = doc_ids
+        self._doc_ordinals = doc_ordinals
+        self._stored = stored
+
+    def __getitem__(self, doc_id: int) -> dict:
+        return json.loads(self._stored[self._doc_ordinals[doc_id]])
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self._doc_ordinals
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._doc_ids)
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+
+class DeltaSegment:
+    """Documents added after the base segment was written, as one saved batch.
+
+    Postings hold global doc ordinals, starting at `first_ordinal`.
+    """
+
+    def __init__(self, segment: IndexSegment) -> None:
+        sections = segment.sections
+        self.path = segment.path
+        self.meta = segment.meta
+        self.first_ordinal: int = segment.meta["first_ordinal"]
+        self.terms = StringTable(sections["terms_index"], sections["terms"])
+        self.term_offsets = sections["term_offsets"]
+        self.doc_counts = sections["doc_counts"]
+        self.postings = sections["postings"]
+        self.doc_ids = sections["doc_ids"]
+        self.doc_lengths = sections["doc_lengths"]
+        self.stored = StringTable(sections["stored_index"], sections["stored"])
+        self.tombstones = sections["tombstones"]
+        self.position_offsets = sections.get("position_offsets")
+        self.positions = sections.get("positions")
+
+    def term_id(self, term: str) -> int:
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def doc_count(self, term: str) -> int:
+        term_id = self.term_id(term)
+        return self.doc_counts[term_id] if term_id >= 0 else 0
+
+    def get_postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return decode_postings_array(self.postings[start:end], self.doc_counts[term_id])
+
+    def get_positions(self, term_id: int, tfs: np.ndarray) -> np.ndarray:
+        start = self.position_offsets[term_id]
+        end = self.position_offsets[term_id + 1]
+        return decode_positions(self.positions[start:end], tfs)
+
+
+class Tombstones:
+    """Deletion bitmap over doc ordinals."""
+
+    def __init__(self, bitmap: bytes = b"") -> None:
+        self.bitmap = bytearray(bitmap)
+        self.count = int.from_bytes(self.bitmap, "little").bit_count()
+
+    def add(self, ordinal: int) -> None:
+        byte, bit = divmod(ordinal, 8)
+        if byte >= len(self.bitmap):
+            self.bitmap.extend(bytes(byte + 1 - len(self.bitmap)))
+        if not self.bitmap[byte] & (1 << bit):
+            self.bitmap[byte] |= 1 << bit
+            self.count += 1
+
+    def __contains__(self, ordinal: int) -> bool:
+        byte = ordinal >> 3
+        return byte < len(self.bitmap) and bool(
+            self.bitmap[byte] & (1 << (ordinal & 7))
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def mask(self, ordinals: np.ndarray) -> np.ndarray:
+        """Boolean array marking which of `ordinals` are deleted."""
+        bits = np.frombuffer(self.bitmap, dtype=np.uint8)
+        deleted = np.zeros(len(ordinals), dtype=bool)
+        byte = ordinals >> 3
+        inside = byte < len(bits)
+        deleted[inside] = (bits[byte[inside]] >> (ordinals[inside] & 7)) & 1 == 1
+        return deleted
+
+
+class LiveOrdinals(Mapping):
+    """doc_id -> ordinal of the live copy of each document.
+
+    Documents added since the base segment shadow base ordinals, and
+    tombstoned ordinals count as missing. Iterates in ordinal order.
+    """
+
+    def __init__(
+        self,
+        base: Mapping[int, int],
+        added: dict[int, int],
+        tombstones: Tombstones,
+        doc_ids: Sequence[int],
+    ) -> None:
+        self._base = base
+        self._added = added
+        self._tombstones = tombstones
+        self._doc_ids = doc_ids
+
+    def __getitem__(self, doc_id: int) -> int:
+        ordinal = self._added.get(doc_id)
+        if ordinal is None:
+            ordinal = self._base[doc_id]
+        if ordinal in self._tombstones:
+            raise KeyError(doc_id)
+        return ordinal
+
+    def __iter__(self) -> Iterator[int]:
+        for ordinal, doc_id in enumerate(self._doc_ids):
+            if ordinal not in self._tombstones:
+                yield doc_id
+
+    def __len__(self) -> int:
+        return len(self._doc_ids) - len(self._tombstones)
+
+
+class LiveDocuments(Mapping):
+    """doc_id -> document over the base segment and documents added since."""
+
+    def __init__(
+        self,
+        base: Mapping[int, dict],
+        added: Sequence[dict],
+        doc_ordinals: LiveOrdinals,
+        base_doc_count: int,
+    ) -> None:
+        self._base = base
+        self._added = added
+        self._doc_ordinals = doc_ordinals
+        self._base_doc_count = base_doc_count
+
+    def __getitem__(self, doc_id: int) -> dict:
+        ordinal = self._doc_ordinals[doc_id]
+        if ordinal < self._base_doc_count:
+            return self._base[doc_id]
+        return self._added[ordinal - self._base_doc_count]
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self._doc_ordinals
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._doc_ordinals)
+
+    def __len__(self) -> int:
+        return len(self._doc_ordinals)
+
+
+def _align(offset: int) -> int:
+    return (offset + SEGMENT_ALIGNMENT - 1) // SEGMENT_ALIGNMENT * SEGMENT_ALIGNMENT
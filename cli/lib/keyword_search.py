@@ -1,108 +1,756 @@
+import glob
+import heapq
+import itertools
+import json
 import math
 import os
-import pickle
 import string
-from collections import Counter, defaultdict
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, lru_cache
 
+import numpy as np
 from nltk.stem import PorterStemmer
 
+from .boolean_query import (
+    NO_MORE_DOCS,
+    AllMatcher,
+    compile_boolean_query,
+    has_boolean_syntax,
+    parse_boolean_query,
+)
+from .index_segment import (
+    DeltaSegment,
+    DocOrdinals,
+    IndexSegment,
+    LiveDocuments,
+    LiveOrdinals,
+    StoredDocuments,
+    StringTable,
+    Tombstones,
+    encode_strings,
+    write_segment,
+)
+from .postings import (
+    decode_positions,
+    decode_postings_array,
+    encode_positions,
+    encode_postings,
+    gallop,
+)
 from .search_utils import (
     BM25_B,
+    BM25_BATCH_SIZE,
+    BM25_BLOCK_SIZE,
     BM25_K1,
+    BM25_MODES,
     CACHE_DIR,
+    DEFAULT_BM25_MODE,
+    DEFAULT_BUILD_WORKERS,
     DEFAULT_SEARCH_LIMIT,
+    MAX_DELETED_FRACTION,
+    MAX_DELTA_SEGMENTS,
+    PARALLEL_BUILD_MIN_DOCS,
+    PROXIMITY_WEIGHT,
+    PROXIMITY_WINDOW,
+    STEM_CACHE_SIZE,
     format_search_result,
+    load_golden_dataset,
     load_movies,
     load_stopwords,
 )
 
+# (ordinals, tfs, positions) of one term; positions are empty unless indexed
+TermPostings = tuple[array, array, array]
+# (sorted terms, postings per term, doc lengths) for one range of documents
+PartialIndex = tuple[list[str], list[TermPostings], array]
+# (ordinals, tfs, positions) decoded from every segment, without deleted docs
+LivePostings = tuple[np.ndarray, np.ndarray, np.ndarray]
+# (ordinals, where each doc's positions start, flat positions) of one term
+TermPositions = tuple[list[int], list[int], list[int]]
+# (term -> row, indptr, doc ordinals, BM25 impacts) of a CSR term-document matrix
+BM25Matrix = tuple[dict[str, int], np.ndarray, np.ndarray, np.ndarray]
+
 
 class InvertedIndex:
     def __init__(self) -> None:
-        self.index = defaultdict(set)
-        self.docmap: dict[int, dict] = {}
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
-        self.term_frequencies = defaultdict(Counter)
-        self.doc_lengths = {}
-
-    def build(self) -> None:
+        self.docmap: Mapping[int, dict] = {}
+        self.index_path = os.path.join(CACHE_DIR, "index.seg")
+        self.manifest_path = os.path.join(CACHE_DIR, "index.manifest.json")
+
+        # documents are numbered by ordinal (docmap order) inside the index;
+        # documents added later take the next ordinals
+        self.doc_ids = array("q")
+        self.doc_ordinals: Mapping[int, int] = {}
+        self.doc_lengths = array("I")
+        self.doc_norms = array("d")
+        self.avg_doc_length = 0.0
+        self.doc_count = 0
+        self.total_doc_length = 0
+
+        # sorted term dictionary; term i owns the postings bytes between
+        # term_offsets[i] and term_offsets[i + 1]
+        self.terms: Sequence[str] = []
+        self.term_offsets = array("Q", [0])
+        self.doc_counts = array("I")
+        self.postings = b""
+        self.idf = array("d")
+
+        # optional term positions, stored per term like the postings
+        self.has_positions = False
+        self.position_offsets = array("Q", [0])
+        self.positions = b""
+
+        # term i owns blocks block_offsets[i]:block_offsets[i + 1]
+        self.term_max_scores = array("d")
+        self.block_offsets = array("Q", [0])
+        self.block_max_scores = array("d")
+        self.block_last_docs = array("I")
+
+        # everything above is the base segment; updates since then live in
+        # saved delta segments, pending postings and tombstones until a merge
+        self.base_id = ""
+        self.base_doc_count = 0
+        self.delta_segments: list[DeltaSegment] = []
+        self.pending: dict[str, TermPostings] = {}
+        self.pending_start = 0
+        self.added_ordinals: dict[int, int] = {}
+        self.added_documents: list[dict] = []
+        self.tombstones = Tombstones()
+        self.deleted_doc_counts: Counter[str] = Counter()
+        self.__unsaved_updates = False
+        self.__stale_norms = False
+        self.__bounds_cache: dict[str, tuple[float, list[float], list[int]]] = {}
+        self.__bm25_matrix: BM25Matrix | None = None
+
+    def build(
+        self,
+        workers: int = DEFAULT_BUILD_WORKERS,
+        positions: bool = False,
+        min_parallel_docs: int = PARALLEL_BUILD_MIN_DOCS,
+    ) -> None:
+        self.has_positions = positions
         movies = load_movies()
+        docmap, doc_ordinals = {}, {}
+        doc_descriptions = []
         for m in movies:
             doc_id = m["id"]
-            doc_description = f"{m['title']} {m['description']}"
-            self.docmap[doc_id] = m
-            self.__add_document(doc_id, doc_description)
+            doc_descriptions.append(_document_text(m))
+            docmap[doc_id] = m
+            doc_ordinals[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+
+        if len(doc_descriptions) < min_parallel_docs:
+            workers = 1
+        # each shard indexes a contiguous range of ordinals, so merging shard
+        # postings in shard order keeps every merged list sorted
+        shard_size = max(1, math.ceil(len(doc_descriptions) / max(1, workers)))
+        starts = range(0, len(doc_descriptions), shard_size)
+        shard_texts = [doc_descriptions[start : start + shard_size] for start in starts]
+        if workers > 1 and len(shard_texts) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                shards = list(
+                    pool.map(
+                        _index_shard,
+                        starts,
+                        shard_texts,
+                        itertools.repeat(positions),
+                    )
+                )
+        else:
+            shards = [
+                _index_shard(start, texts, positions)
+                for start, texts in zip(starts, shard_texts)
+            ]
+
+        self.docmap = docmap
+        self.doc_ordinals = doc_ordinals
+        self.__merge_shards(shards)
+        self.__compute_bm25_stats()
+        self.__compute_score_bounds()
 
     def save(self) -> None:
         os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-        with open(self.tf_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+        # a built or merged index has no base segment on disk yet
+        if not self.base_id or self.__needs_merge():
+            self.merge()
+        if not self.base_id:
+            self.__save_base()
+        elif self.__unsaved_updates:
+            self.__save_delta()
+
+    def __save_base(self) -> None:
+        term_index, terms = encode_strings(self.terms)
+        stored_index, stored = encode_strings(
+            [json.dumps(self.docmap[doc_id]) for doc_id in self.doc_ids]
+        )
+        id_order = sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__)
+        self.base_id = uuid.uuid4().hex
+        write_segment(
+            self.index_path,
+            {
+                "base_id": self.base_id,
+                "avg_doc_length": self.avg_doc_length,
+                "total_doc_length": self.total_doc_length,
+                "positions": self.has_positions,
+            },
+            {
+                "terms": terms,
+                "terms_index": term_index,
+                "term_offsets": self.term_offsets,
+                "doc_counts": self.doc_counts,
+                "position_offsets": self.position_offsets,
+                "positions": self.positions,
+                "idf": self.idf,
+                "term_max_scores": self.term_max_scores,
+                "block_offsets": self.block_offsets,
+                "block_max_scores": self.block_max_scores,
+                "block_last_docs": self.block_last_docs,
+                "postings": self.postings,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths,
+                "doc_norms": self.doc_norms,
+                "sorted_doc_ids": array("q", (self.doc_ids[i] for i in id_order)),
+                "sorted_ordinals": array("I", id_order),
+                "stored": stored,
+                "stored_index": stored_index,
+            },
+        )
+        # the new base makes every delta segment stale; remove the manifest
+        # before the files it lists, so a crash only leaves unreferenced files
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        for path in glob.glob(os.path.join(CACHE_DIR, "index.*.seg")):
+            os.remove(path)
+
+    def __save_delta(self) -> None:
+        """Append documents added since the last save as a new delta segment.
+
+        The segment also carries the current tombstones and BM25 statistics,
+        so the newest delta segment always describes the whole index.
+        """
+        terms = sorted(self.pending)
+        postings = _encode_term_postings(
+            (self.pending[term] for term in terms), self.has_positions
+        )
+        term_index, term_data = encode_strings(terms)
+        first_added = self.pending_start - self.base_doc_count
+        stored_index, stored = encode_strings(
+            [json.dumps(doc) for doc in self.added_documents[first_added:]]
+        )
+        name = f"index.{self.base_id}.{len(self.delta_segments) + 1}.seg"
+        path = os.path.join(CACHE_DIR, name)
+        write_segment(
+            path,
+            {
+                "first_ordinal": self.pending_start,
+                "doc_count": self.doc_count,
+                "total_doc_length": self.total_doc_length,
+                "deleted_doc_counts": self.deleted_doc_counts,
+            },
+            {
+                "terms": term_data,
+                "terms_index": term_index,
+                **postings,
+                "doc_ids": self.doc_ids[self.pending_start :],
+                "doc_lengths": self.doc_lengths[self.pending_start :],
+                "stored": stored,
+                "stored_index": stored_index,
+                "tombstones": bytes(self.tombstones.bitmap),
+            },
+        )
+        self.delta_segments.append(DeltaSegment(IndexSegment(path)))
+        self.pending = {}
+        self.pending_start = len(self.doc_ids)
+
+        # the manifest is the commit point: a delta segment only counts once
+        # it is listed here
+        manifest = {
+            "base_id": self.base_id,
+            "segments": [
+                os.path.basename(segment.path) for segment in self.delta_segments
+            ],
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.__unsaved_updates = False
 
     def load(self) -> None:
-        with open(self.index_path, "rb") as f:
-            self.index = pickle.load(f)
-        with open(self.docmap_path, "rb") as f:
-            self.docmap = pickle.load(f)
-        with open(self.tf_path, "rb") as f:
-            self.term_frequencies = pickle.load(f)
-        with open(self.doc_lengths_path, "rb") as f:
-            self.doc_lengths = pickle.load(f)
+        # mapping the segment is constant time; pages load as queries touch them
+        segment = IndexSegment(self.index_path)
+        sections = segment.sections
+        self.base_id = segment.meta["base_id"]
+        self.avg_doc_length = segment.meta["avg_doc_length"]
+        self.total_doc_length = segment.meta["total_doc_length"]
+        self.terms = StringTable(sections["terms_index"], sections["terms"])
+        self.term_offsets = sections["term_offsets"]
+        self.doc_counts = sections["doc_counts"]
+        self.has_positions = segment.meta["positions"]
+        self.position_offsets = sections["position_offsets"]
+        self.positions = sections["positions"]
+        self.idf = sections["idf"]
+        self.term_max_scores = sections["term_max_scores"]
+        self.block_offsets = sections["block_offsets"]
+        self.block_max_scores = sections["block_max_scores"]
+        self.block_last_docs = sections["block_last_docs"]
+        self.postings = sections["postings"]
+        self.doc_ids = sections["doc_ids"]
+        self.doc_lengths = sections["doc_lengths"]
+        self.doc_norms = sections["doc_norms"]
+        self.doc_count = len(self.doc_ids)
+        self.doc_ordinals = DocOrdinals(
+            sections["sorted_doc_ids"], sections["sorted_ordinals"]
+        )
+        self.docmap = StoredDocuments(
+            self.doc_ids,
+            self.doc_ordinals,
+            StringTable(sections["stored_index"], sections["stored"]),
+        )
+
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        # a manifest left over from an older base segment describes nothing
+        if manifest["base_id"] != self.base_id:
+            return
+        deltas = [
+            DeltaSegment(IndexSegment(os.path.join(CACHE_DIR, name)))
+            for name in manifest["segments"]
+        ]
+        if deltas:
+            self.__load_deltas(deltas)
+
+    def disk_version(self) -> tuple:
+        """Identifies the saved index; every committed save changes it.
+
+        Saves replace the base segment and the manifest through a rename, so
+        their inode, mtime and size tell one saved state from the next.
+        """
+        return (_file_version(self.index_path), _file_version(self.manifest_path))
+
+    def __load_deltas(self, deltas: list[DeltaSegment]) -> None:
+        # delta segments are small and read eagerly; the newest one holds the
+        # tombstones and statistics for the whole index
+        latest = deltas[-1]
+        self.tombstones = Tombstones(latest.tombstones)
+        self.deleted_doc_counts = Counter(latest.meta["deleted_doc_counts"])
+        self.doc_count = latest.meta["doc_count"]
+        self.total_doc_length = latest.meta["total_doc_length"]
+
+        self.__open_for_updates()
+        for delta in deltas:
+            for ordinal, doc_id in enumerate(delta.doc_ids, delta.first_ordinal):
+                self.added_ordinals[doc_id] = ordinal
+            self.doc_ids.extend(delta.doc_ids)
+            self.doc_lengths.extend(delta.doc_lengths)
+            self.added_documents.extend(json.loads(doc) for doc in delta.stored)
+            self.delta_segments.append(delta)
+        self.pending_start = len(self.doc_ids)
+        self.__update_stats()
+        self.__unsaved_updates = False
+
+    def __open_for_updates(self) -> None:
+        """Switch the loaded or built base segment over to updatable views."""
+        if not self.__is_compact():
+            return
+        doc_ids, doc_lengths = array("q"), array("I")
+        doc_ids.frombytes(memoryview(self.doc_ids).cast("B"))
+        doc_lengths.frombytes(memoryview(self.doc_lengths).cast("B"))
+        self.doc_ids, self.doc_lengths = doc_ids, doc_lengths
+        self.base_doc_count = len(doc_ids)
+        self.pending_start = len(doc_ids)
+        self.doc_ordinals = LiveOrdinals(
+            self.doc_ordinals, self.added_ordinals, self.tombstones, self.doc_ids
+        )
+        self.docmap = LiveDocuments(
+            self.docmap, self.added_documents, self.doc_ordinals, self.base_doc_count
+        )
+
+    def __is_compact(self) -> bool:
+        return not isinstance(self.docmap, LiveDocuments)
+
+    def __needs_merge(self) -> bool:
+        return len(self.delta_segments) >= MAX_DELTA_SEGMENTS or len(
+            self.tombstones
+        ) > MAX_DELETED_FRACTION * len(self.doc_ids)
+
+    def add_document(self, doc: dict) -> None:
+        doc_id = doc["id"]
+        if doc_id in self.docmap:
+            raise ValueError(
+                f"document {doc_id} is already indexed, use update_document"
+            )
+        self.__open_for_updates()
+
+        ordinal = len(self.doc_ids)
+        tokens = tokenize_text(_document_text(doc))
+        for token, positions in _token_positions(tokens).items():
+            if token not in self.pending:
+                self.pending[token] = (array("I"), array("I"), array("I"))
+            self.pending[token][0].append(ordinal)
+            self.pending[token][1].append(len(positions))
+            if self.has_positions:
+                self.pending[token][2].extend(positions)
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(len(tokens))
+        self.added_ordinals[doc_id] = ordinal
+        self.added_documents.append(doc)
+
+        self.doc_count += 1
+        self.total_doc_length += len(tokens)
+        self.__update_stats()
+
+    def delete_document(self, doc_id: int) -> None:
+        ordinal = self.doc_ordinals.get(doc_id)
+        if ordinal is None:
+            raise ValueError(f"document {doc_id} is not indexed")
+        self.__open_for_updates()
+
+        # postings stay put until the next merge; only the statistics change
+        doc = self.docmap[doc_id]
+        self.deleted_doc_counts.update(set(tokenize_text(_document_text(doc))))
+        self.tombstones.add(ordinal)
+
+        self.doc_count -= 1
+        self.total_doc_length -= self.doc_lengths[ordinal]
+        self.__update_stats()
+
+    def update_document(self, doc: dict) -> None:
+        self.delete_document(doc["id"])
+        self.add_document(doc)
+
+    def __update_stats(self) -> None:
+        self.avg_doc_length = (
+            self.total_doc_length / self.doc_count if self.doc_count else 0.0
+        )
+        self.__stale_norms = True
+        self.__bounds_cache.clear()
+        self.__bm25_matrix = None
+        self.__unsaved_updates = True
+
+    def __refresh_norms(self) -> None:
+        if not self.__stale_norms:
+            return
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+        if self.avg_doc_length > 0:
+            # same operations as __length_norm, so the norms match it exactly
+            norms = 1 - BM25_B + BM25_B * (doc_lengths / self.avg_doc_length)
+        else:
+            norms = np.ones(len(doc_lengths))
+        self.doc_norms = array("d")
+        self.doc_norms.frombytes(norms.tobytes())
+        self.__stale_norms = False
+
+    def merge(self) -> None:
+        """Compact the base segment, delta segments and pending documents.
+
+        Deleted documents are dropped and the survivors are renumbered in
+        ordinal order, so the result matches a fresh build over the live
+        documents. The merged index is written as a new base segment on save.
+        """
+        if self.__is_compact():
+            return
+        ordinal_count = len(self.doc_ids)
+        deleted = self.tombstones.mask(np.arange(ordinal_count))
+        new_ordinals = np.cumsum(~deleted) - 1
+
+        sources = [(0, self.__iter_base_postings())]
+        for delta in self.delta_segments:
+            sources.append((delta.first_ordinal, _iter_delta_postings(delta)))
+        pending = (
+            (term, *(np.array(values, dtype=np.int64) for values in postings))
+            for term, postings in sorted(self.pending.items())
+        )
+        sources.append((self.pending_start, pending))
+        ends = [start for start, _ in sources[1:]] + [ordinal_count]
+
+        shards = []
+        for (start, postings), end in zip(sources, ends):
+            terms, shard_postings = [], []
+            for term, ordinals, tfs, positions in postings:
+                live = ~deleted[ordinals]
+                if not live.any():
+                    continue
+                if self.has_positions:
+                    positions = positions[np.repeat(live, tfs)]
+                terms.append(term)
+                shard_postings.append(
+                    (
+                        array("I", new_ordinals[ordinals[live]].tolist()),
+                        array("I", tfs[live].tolist()),
+                        array("I", positions.tolist()),
+                    )
+                )
+            doc_lengths = array(
+                "I", (self.doc_lengths[o] for o in range(start, end) if not deleted[o])
+            )
+            shards.append((terms, shard_postings, doc_lengths))
+
+        docmap = {doc_id: self.docmap[doc_id] for doc_id in self.docmap}
+        has_positions = self.has_positions
+        self.__init__()
+        self.has_positions = has_positions
+        self.docmap = docmap
+        self.doc_ids = array("q", docmap)
+        self.doc_ordinals = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        self.__merge_shards(shards)
+        self.__compute_bm25_stats()
+        self.__compute_score_bounds()
+
+    def __iter_base_postings(
+        self,
+    ) -> Iterator[tuple[str, np.ndarray, np.ndarray, np.ndarray]]:
+        for term_id, term in enumerate(self.terms):
+            ordinals, tfs = self.__get_postings(term_id)
+            yield term, ordinals, tfs, self.__get_positions(term_id, tfs)
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index.get(term, set())
-        return sorted(list(doc_ids))
+        ordinals, _ = self.__get_live_postings(term)
+        return sorted(self.doc_ids[ordinal] for ordinal in ordinals)
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = tokenize_text(text)
-        for token in set(tokens):
-            self.index[token].add(doc_id)
-        self.term_frequencies[doc_id].update(tokens)
-        self.doc_lengths[doc_id] = len(tokens)
+    def __merge_shards(self, shards: list[PartialIndex]) -> None:
+        """K-way merge of shard term dictionaries into one compressed index."""
+        self.doc_lengths = array("I")
+        for _, _, doc_lengths in shards:
+            self.doc_lengths.extend(doc_lengths)
 
-    def get_tf(self, doc_id: int, term: str) -> int:
+        shard_terms = [
+            zip(terms, itertools.repeat(shard), itertools.count())
+            for shard, (terms, _, _) in enumerate(shards)
+        ]
+        self.terms = []
+        term_postings = []
+        merged = heapq.merge(*shard_terms)
+        for term, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+            ordinals, tfs, positions = array("I"), array("I"), array("I")
+            for _, shard, i in entries:
+                shard_ordinals, shard_tfs, shard_positions = shards[shard][1][i]
+                ordinals.extend(shard_ordinals)
+                tfs.extend(shard_tfs)
+                positions.extend(shard_positions)
+            self.terms.append(term)
+            term_postings.append((ordinals, tfs, positions))
+        sections = _encode_term_postings(term_postings, self.has_positions)
+        self.term_offsets = sections["term_offsets"]
+        self.doc_counts = sections["doc_counts"]
+        self.postings = sections["postings"]
+        if self.has_positions:
+            self.position_offsets = sections["position_offsets"]
+            self.positions = sections["positions"]
+
+    def __term_id(self, term: str) -> int:
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def __get_postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        data = memoryview(self.postings)[start:end]
+        return decode_postings_array(data, self.doc_counts[term_id])
+
+    def __get_positions(self, term_id: int, tfs: np.ndarray) -> np.ndarray:
+        if not self.has_positions:
+            return np.zeros(0, dtype=np.int64)
+        start = self.position_offsets[term_id]
+        end = self.position_offsets[term_id + 1]
+        return decode_positions(memoryview(self.positions)[start:end], tfs)
+
+    def __get_live_postings(self, term: str) -> tuple[list[int], list[int]]:
+        ordinals, tfs = self.__get_live_postings_array(term)
+        return ordinals.tolist(), tfs.tolist()
+
+    def __get_live_postings_array(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        ordinals, tfs, _ = self.__collect_postings(term, with_positions=False)
+        return ordinals, tfs
+
+    def __collect_postings(self, term: str, with_positions: bool) -> LivePostings:
+        """Postings of `term` across every segment, minus deleted documents.
+
+        Positions are only decoded when asked for; otherwise they come back
+        empty.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        parts = [(empty, empty, empty)]
+        term_id = self.__term_id(term)
+        if term_id >= 0:
+            ordinals, tfs = self.__get_postings(term_id)
+            positions = self.__get_positions(term_id, tfs) if with_positions else empty
+            parts.append((ordinals, tfs, positions))
+        for delta in self.delta_segments:
+            delta_term_id = delta.term_id(term)
+            if delta_term_id >= 0:
+                ordinals, tfs = delta.get_postings(delta_term_id)
+                if with_positions and self.has_positions:
+                    positions = delta.get_positions(delta_term_id, tfs)
+                else:
+                    positions = empty
+                parts.append((ordinals, tfs, positions))
+        if term in self.pending:
+            ordinals, tfs, positions = self.pending[term]
+            parts.append(
+                (
+                    np.array(ordinals, dtype=np.int64),
+                    np.array(tfs, dtype=np.int64),
+                    np.array(positions if with_positions else [], dtype=np.int64),
+                )
+            )
+
+        # segments cover increasing ordinal ranges, so this stays sorted
+        ordinals, tfs, positions = (np.concatenate(column) for column in zip(*parts))
+        if self.tombstones:
+            live = ~self.tombstones.mask(ordinals)
+            if with_positions and self.has_positions:
+                positions = positions[np.repeat(live, tfs)]
+            ordinals, tfs = ordinals[live], tfs[live]
+        return ordinals, tfs, positions
+
+    def __get_doc_count(self, term: str) -> int:
+        term_id = self.__term_id(term)
+        doc_count = self.doc_counts[term_id] if term_id >= 0 else 0
+        for delta in self.delta_segments:
+            doc_count += delta.doc_count(term)
+        if term in self.pending:
+            doc_count += len(self.pending[term][0])
+        return doc_count - self.deleted_doc_counts[term]
+
+    def __term_idf(self, term: str) -> float:
+        term_doc_count = self.__get_doc_count(term)
+        return math.log(
+            (self.doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1
+        )
+
+    def __compute_bm25_stats(self) -> None:
+        self.avg_doc_length = self.__get_avg_doc_length()
+        self.doc_count = len(self.doc_lengths)
+        self.total_doc_length = sum(self.doc_lengths)
+        self.doc_norms = array(
+            "d",
+            (
+                self.__length_norm(length, self.avg_doc_length)
+                for length in self.doc_lengths
+            ),
+        )
+        doc_count = len(self.docmap)
+        self.idf = array("d")
+        for term_doc_count in self.doc_counts:
+            self.idf.append(
+                math.log(
+                    (doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1
+                )
+            )
+
+    def __compute_score_bounds(self) -> None:
+        self.term_max_scores = array("d")
+        self.block_offsets = array("Q", [0])
+        self.block_max_scores = array("d")
+        self.block_last_docs = array("I")
+        for term_id in range(len(self.terms)):
+            ordinals, tfs = self.__get_postings(term_id)
+            block_max_scores, block_last_docs = self.__block_bounds(
+                ordinals.tolist(), tfs.tolist(), self.idf[term_id]
+            )
+            self.block_max_scores.extend(block_max_scores)
+            self.block_last_docs.extend(block_last_docs)
+            self.term_max_scores.append(max(block_max_scores, default=0.0))
+            self.block_offsets.append(len(self.block_max_scores))
+
+    def __block_bounds(
+        self, ordinals: list[int], tfs: list[int], idf: float
+    ) -> tuple[list[float], list[int]]:
+        block_max_scores, block_last_docs = [], []
+        for start in range(0, len(ordinals), BM25_BLOCK_SIZE):
+            end = start + BM25_BLOCK_SIZE
+            block_max_scores.append(
+                max(
+                    self.__term_score(tf, ordinal, idf)
+                    for ordinal, tf in zip(ordinals[start:end], tfs[start:end])
+                )
+            )
+            block_last_docs.append(ordinals[start:end][-1])
+        return block_max_scores, block_last_docs
+
+    def __score_bounds(
+        self, term: str, postings: tuple[list[int], list[int]], idf: float
+    ) -> tuple[float, Sequence[float], Sequence[int]]:
+        """Term and per-block score upper bounds for pruned retrieval.
+
+        The base segment stores them; after updates they are recomputed from
+        the live postings and cached until the statistics change again.
+        """
+        if self.__is_compact():
+            term_id = self.__term_id(term)
+            start, end = self.block_offsets[term_id], self.block_offsets[term_id + 1]
+            return (
+                self.term_max_scores[term_id],
+                self.block_max_scores[start:end],
+                self.block_last_docs[start:end],
+            )
+        if term not in self.__bounds_cache:
+            block_max_scores, block_last_docs = self.__block_bounds(*postings, idf)
+            self.__bounds_cache[term] = (
+                max(block_max_scores, default=0.0),
+                block_max_scores,
+                block_last_docs,
+            )
+        return self.__bounds_cache[term]
+
+    def __term_score(self, tf: int, ordinal: int, idf: float) -> float:
+        tf_component = (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * self.doc_norms[ordinal])
+        return tf_component * idf
+
+    @staticmethod
+    def __length_norm(
+        doc_length: int, avg_doc_length: float, b: float = BM25_B
+    ) -> float:
+        if avg_doc_length > 0:
+            return 1 - b + b * (doc_length / avg_doc_length)
+        return 1
+
+    def __get_single_token(self, term: str) -> str:
         tokens = tokenize_text(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
-        token = tokens[0]
-        return self.term_frequencies[doc_id][token]
+        return tokens[0]
+
+    def get_tf(self, doc_id: int, term: str) -> int:
+        token = self.__get_single_token(term)
+        ordinal = self.doc_ordinals.get(doc_id)
+        if ordinal is None:
+            return 0
+        ordinals, tfs = self.__get_live_postings(token)
+        i = bisect_left(ordinals, ordinal)
+        if i < len(ordinals) and ordinals[i] == ordinal:
+            return tfs[i]
+        return 0
 
     def get_idf(self, term: str) -> float:
-        tokens = tokenize_text(term)
-        if len(tokens) != 1:
-            raise ValueError("term must be a single token")
-        token = tokens[0]
+        token = self.__get_single_token(term)
         doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
+        term_doc_count = self.__get_doc_count(token)
         return math.log((doc_count + 1) / (term_doc_count + 1))
 
     def get_bm25_idf(self, term: str) -> float:
-        tokens = tokenize_text(term)
-        if len(tokens) != 1:
-            raise ValueError("term must be a single token")
-        token = tokens[0]
+        token = self.__get_single_token(term)
         doc_count = len(self.docmap)
-        term_doc_count = len(self.index.get(token, list()))
+        term_doc_count = self.__get_doc_count(token)
         return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
 
     def get_bm25_tf(
         self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B
     ) -> float:
         tf = self.get_tf(doc_id, term)
-        doc_length = self.doc_lengths.get(doc_id, 0)
-        avg_doc_length = self.__get_avg_doc_length()
-        if avg_doc_length > 0:
-            length_norm = 1 - b + b * (doc_length / avg_doc_length)
-        else:
-            length_norm = 1
+        ordinal = self.doc_ordinals.get(doc_id)
+        doc_length = self.doc_lengths[ordinal] if ordinal is not None else 0
+        length_norm = self.__length_norm(doc_length, self.avg_doc_length, b)
         return (tf * (k1 + 1)) / (tf + k1 * length_norm)
 
     def get_tf_idf(self, doc_id: int, term: str) -> float:
@@ -114,7 +762,7 @@ class InvertedIndex:
         if not self.doc_lengths or len(self.doc_lengths) == 0:
             return 0.0
         total_length = 0
-        for length in self.doc_lengths.values():
+        for length in self.doc_lengths:
             total_length += length
         return total_length / len(self.doc_lengths)
 
@@ -123,20 +771,386 @@ class InvertedIndex:
         idf_component = self.get_bm25_idf(term)
         return tf_component * idf_component
 
-    def bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+    def __get_query_terms(self, query_tokens: list[str]) -> list[str]:
+        terms = []
+        for query_token in query_tokens:
+            # bm25() re-analyzes each query token, so do the same to stay exact
+            term = self.__get_single_token(query_token)
+            if self.__get_doc_count(term) > 0:
+                terms.append(term)
+        return terms
+
+    def bm25_scores(self, query_tokens: list[str]) -> dict[int, float]:
+        """Score documents term-at-a-time, walking only the query terms' postings.
+
+        Scores are keyed by doc ordinal. Documents missing from every posting
+        list score 0 and are left out.
+        """
+        self.__refresh_norms()
+        scores: dict[int, float] = {}
+        for term in self.__get_query_terms(query_tokens):
+            idf = self.__term_idf(term)
+            ordinals, tfs = self.__get_live_postings(term)
+            for ordinal, tf in zip(ordinals, tfs):
+                term_score = self.__term_score(tf, ordinal, idf)
+                scores[ordinal] = scores.get(ordinal, 0.0) + term_score
+        return scores
+
+    def bm25_candidate_scores(
+        self, query_tokens: list[str], doc_ids: Iterable[int]
+    ) -> dict[int, float]:
+        """BM25 scores of just the given documents, keyed by doc ordinal.
+
+        Each candidate is looked up in the query terms' postings by binary
+        search, so the scoring work grows with the candidates, not with the
+        postings. Unknown and deleted documents are left out; candidates
+        matching no query term score 0.
+        """
+        self.__refresh_norms()
+        ordinals = {self.doc_ordinals.get(doc_id) for doc_id in doc_ids}
+        ordinals.discard(None)
+        candidates = np.array(sorted(ordinals), dtype=np.int64)
+        scores = dict.fromkeys(candidates.tolist(), 0.0)
+        for term in self.__get_query_terms(query_tokens):
+            idf = self.__term_idf(term)
+            postings, tfs = self.__get_live_postings_array(term)
+            # query terms all have live postings, so the clamp stays in range
+            found = np.minimum(np.searchsorted(postings, candidates), len(postings) - 1)
+            hits = found[postings[found] == candidates]
+            for ordinal, tf in zip(postings[hits].tolist(), tfs[hits].tolist()):
+                scores[ordinal] += self.__term_score(tf, ordinal, idf)
+        return scores
+
+    def bm25_top_k(
+        self, query_tokens: list[str], limit: int
+    ) -> list[tuple[int, float]]:
+        """Block-Max MaxScore retrieval of the top `limit` BM25 documents.
+
+        Returns exactly what rank_scores(bm25_scores(...)) would, working a
+        whole posting list at a time. The exact scores of each term's best
+        `limit` postings give a threshold. Terms whose bounds together can't
+        reach it only score documents that other terms match, and documents
+        whose block bounds can't reach it are dropped before exact scoring.
+        """
+        if limit <= 0:
+            return []
+
+        self.__refresh_norms()
+        query_terms = self.__get_query_terms(query_tokens)
+        weights = Counter(query_terms)
+        doc_norms = np.frombuffer(self.doc_norms, dtype=np.float64)
+        postings, impacts, bounds = {}, {}, {}
+        for term in weights:
+            idf = self.__term_idf(term)
+            ordinals, tfs = self.__get_live_postings_array(term)
+            # same operations as __term_score, so every impact matches it
+            tf = tfs.astype(np.float64)
+            tf_component = (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * doc_norms[ordinals])
+            postings[term] = ordinals
+            impacts[term] = tf_component * idf
+            bounds[term] = self.__score_bounds(term, (ordinals, tfs), idf)
+
+        def exact_scores(candidates: np.ndarray) -> np.ndarray:
+            # summed in query token order, exactly like bm25_scores
+            scores = np.zeros(len(candidates), dtype=np.float64)
+            for term in query_terms:
+                ordinals = postings[term]
+                found = np.searchsorted(ordinals, candidates)
+                found = np.minimum(found, len(ordinals) - 1)
+                hit = ordinals[found] == candidates
+                scores[hit] += impacts[term][found[hit]]
+            return scores
+
+        empty = np.zeros(0, dtype=np.int64)
+        seeds = [empty]
+        for term in weights:
+            best = postings[term]
+            if len(best) > limit:
+                best = best[np.argpartition(impacts[term], -limit)[-limit:]]
+            seeds.append(best)
+        seeds = np.unique(np.concatenate(seeds))
+        threshold = -math.inf
+        if len(seeds) >= limit:
+            threshold = float(np.partition(exact_scores(seeds), -limit)[-limit])
+
+        # ascending upper bound, so a prefix of terms can become non-essential
+        terms = sorted(weights, key=lambda t: weights[t] * bounds[t][0])
+        prefix_bounds = itertools.accumulate(weights[t] * bounds[t][0] for t in terms)
+        # the prefix bounds only grow, so this counts a prefix of the terms
+        first_essential = sum(
+            1 for bound in prefix_bounds if not _can_reach(bound, threshold)
+        )
+        candidates = np.unique(
+            np.concatenate([empty, *(postings[t] for t in terms[first_essential:])])
+        )
+
+        # tighten each candidate's bound with the blocks that could hold it
+        candidate_bounds = np.zeros(len(candidates), dtype=np.float64)
+        for term in terms:
+            _, block_max_scores, block_last_docs = bounds[term]
+            block_max_scores = np.asarray(block_max_scores, dtype=np.float64)
+            block = np.searchsorted(np.asarray(block_last_docs), candidates)
+            inside = block < len(block_max_scores)
+            candidate_bounds[inside] += weights[term] * block_max_scores[block[inside]]
+        candidates = candidates[_can_reach(candidate_bounds, threshold)]
+
+        scores = exact_scores(candidates)
+        order = np.lexsort((candidates, -scores))[:limit]
+        ranked = list(zip(candidates[order].tolist(), scores[order].tolist()))
+        scored = {ordinal for ordinal, _ in ranked}
+        return self.__to_doc_ids(self.__pad_ranking(ranked, scored, limit))
+
+    def get_bm25_matrix(self) -> BM25Matrix:
+        """CSR term-document matrix of precomputed BM25 impacts.
+
+        Row t holds the score term t adds to each live document containing it,
+        i.e. the transposed document-term matrix, so that a query only touches
+        the rows of its terms. Built on first use and kept until the index
+        changes.
+        """
+        if self.__bm25_matrix is not None:
+            return self.__bm25_matrix
+        self.__refresh_norms()
+        if self.__is_compact():
+            terms = list(self.terms)
+        else:
+            terms = sorted(
+                {*self.terms, *self.pending}.union(
+                    *(delta.terms for delta in self.delta_segments)
+                )
+            )
+
+        ordinals, tfs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        counts, idf = [], []
+        for term in terms:
+            term_ordinals, term_tfs = self.__get_live_postings_array(term)
+            ordinals.append(term_ordinals)
+            tfs.append(term_tfs)
+            counts.append(len(term_ordinals))
+            idf.append(self.__term_idf(term))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        indices = np.concatenate(ordinals)
+        tf = np.concatenate(tfs).astype(np.float64)
+
+        # same operations as __term_score, so every impact matches it exactly
+        doc_norms = np.frombuffer(self.doc_norms, dtype=np.float64)
+        tf_component = (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * doc_norms[indices])
+        impacts = tf_component * np.repeat(np.array(idf), counts)
+
+        term_rows = {term: row for row, term in enumerate(terms)}
+        self.__bm25_matrix = (term_rows, indptr, indices, impacts)
+        return self.__bm25_matrix
+
+    def bm25_rank_batch(
+        self, queries: list[str], limit: int = DEFAULT_SEARCH_LIMIT
+    ) -> list[list[tuple[int, float]]]:
+        """Rank many queries with sparse products against get_bm25_matrix().
+
+        Each result list is exactly what bm25_rank(query, limit) returns.
+        """
+        term_rows, indptr, indices, impacts = self.get_bm25_matrix()
+        ordinal_count = len(self.doc_ids)
+        deleted = self.tombstones.mask(np.arange(ordinal_count))
+        limit = min(limit, self.doc_count)
+
+        results = []
+        for start in range(0, len(queries), BM25_BATCH_SIZE):
+            batch = queries[start : start + BM25_BATCH_SIZE]
+
+            # the sparse query matrix, one (query, term row) entry per query
+            # token, kept in token order
+            query_rows, query_terms = [], []
+            for i, query in enumerate(batch):
+                for term in self.__get_query_terms(tokenize_text(query)):
+                    query_rows.append(i)
+                    query_terms.append(term_rows[term])
+            query_rows = np.array(query_rows, dtype=np.int64)
+            query_terms = np.array(query_terms, dtype=np.int64)
+
+            # expand every entry into the matrix row it selects
+            lengths = indptr[query_terms + 1] - indptr[query_terms]
+            row_starts = indptr[query_terms] - np.cumsum(lengths) + lengths
+            positions = np.repeat(row_starts, lengths) + np.arange(lengths.sum())
+            cells = np.repeat(query_rows, lengths) * ordinal_count + indices[positions]
+
+            # bincount adds weights in input order, so each document's score
+            # is summed in query token order, exactly like bm25_scores; with
+            # no weights at all (no query term indexed) it counts in integers
+            scores = np.bincount(
+                cells, weights=impacts[positions], minlength=len(batch) * ordinal_count
+            )
+            scores = scores.astype(np.float64).reshape(len(batch), ordinal_count)
+            scores[:, deleted] = -np.inf
+            results.extend(self.__top_k_row(row, limit) for row in scores)
+        return results
+
+    def __top_k_row(self, scores: np.ndarray, limit: int) -> list[tuple[int, float]]:
+        if limit <= 0:
+            return []
+        # take every document tied with the k-th score, then break ties by
+        # ordinal like rank_scores; unscored documents are the 0.0 padding
+        top = np.argpartition(scores, -limit)[-limit:]
+        candidates = np.flatnonzero(scores >= scores[top].min())
+        order = np.lexsort((candidates, -scores[candidates]))[:limit]
+        ranked = candidates[order]
+        return self.__to_doc_ids(list(zip(ranked.tolist(), scores[ranked].tolist())))
+
+    def rank_scores(
+        self, scores: dict[int, float], limit: int
+    ) -> list[tuple[int, float]]:
+        """Order ordinal-keyed scores like a full sort over the docmap would.
+
+        Ties keep docmap order and zero-score documents pad out the results,
+        which come back as (doc_id, score) pairs.
+        """
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return self.__to_doc_ids(self.__pad_ranking(ranked[:limit], scores, limit))
+
+    def __pad_ranking(
+        self, ranked: list[tuple[int, float]], scored, limit: int
+    ) -> list[tuple[int, float]]:
+        if len(ranked) < limit:
+            for ordinal in range(len(self.doc_ids)):
+                if ordinal not in scored and ordinal not in self.tombstones:
+                    ranked.append((ordinal, 0.0))
+                    if len(ranked) >= limit:
+                        break
+        return ranked
+
+    def __to_doc_ids(self, ranked: list[tuple[int, float]]) -> list[tuple[int, float]]:
+        return [(self.doc_ids[ordinal], score) for ordinal, score in ranked]
+
+    def bm25_rank(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        mode: str = DEFAULT_BM25_MODE,
+        filter_query: str | None = None,
+        candidates: Iterable[int] | None = None,
+    ) -> list[tuple[int, float]]:
         query_tokens = tokenize_text(query)
+        if candidates is not None:
+            scores = self.bm25_candidate_scores(query_tokens, candidates)
+            ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+            return self.__to_doc_ids(ranked[:limit])
+        if filter_query is not None:
+            # the filter fixes the candidate set, so score it exhaustively
+            scores = self.bm25_scores(query_tokens)
+            ranked = sorted(
+                ((o, scores.get(o, 0.0)) for o in self.boolean_match(filter_query)),
+                key=lambda x: (-x[1], x[0]),
+            )
+            return self.__to_doc_ids(ranked[:limit])
+        if mode == "exhaustive":
+            return self.rank_scores(self.bm25_scores(query_tokens), limit)
+        if mode == "pruned":
+            return self.bm25_top_k(query_tokens, limit)
+        raise ValueError(f"unknown BM25 mode '{mode}', expected one of {BM25_MODES}")
+
+    def boolean_match(self, query: str) -> Iterator[int]:
+        """Ordinals of live documents matching an AND/OR/NOT query, in order.
+
+        Matching is lazy, so callers that stop early never walk the rest of
+        the postings.
+        """
+        matcher = compile_boolean_query(
+            parse_boolean_query(query),
+            lambda word: [
+                self.__get_live_postings_array(token)[0].tolist()
+                for token in tokenize_text(word)
+            ],
+            lambda: AllMatcher(len(self.doc_ids), self.tombstones),
+        )
+        if matcher is None:
+            return
+        ordinal = matcher.advance(0)
+        while ordinal != NO_MORE_DOCS:
+            yield ordinal
+            ordinal = matcher.advance(ordinal + 1)
+
+    def __get_term_positions(self, term: str) -> TermPositions:
+        ordinals, tfs, positions = self.__collect_postings(term, with_positions=True)
+        starts = np.zeros(len(tfs) + 1, dtype=np.int64)
+        np.cumsum(tfs, out=starts[1:])
+        return ordinals.tolist(), starts.tolist(), positions.tolist()
+
+    def proximity_rank(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        window: int = PROXIMITY_WINDOW,
+        phrase: bool = False,
+    ) -> list[tuple[int, float]]:
+        """BM25 boosted for query terms that occur close together in query order.
+
+        Every adjacent pair of query terms found `distance` <= `window` tokens
+        apart adds PROXIMITY_WEIGHT * min(idf) / distance. With `phrase`, only
+        documents containing the analyzed query as a contiguous phrase are
+        returned. Positions come from the index, not from document text.
+        """
+        if not self.has_positions:
+            raise ValueError(
+                "index has no term positions, rebuild with build --positions"
+            )
+        terms = tokenize_text(query)
+        scores = self.bm25_scores(terms)
+        positions = {term: self.__get_term_positions(term) for term in terms}
+
+        for left, right in itertools.pairwise(terms):
+            weight = PROXIMITY_WEIGHT * min(
+                self.__term_idf(left), self.__term_idf(right)
+            )
+            left_ordinals, left_starts, left_positions = positions[left]
+            right_ordinals, right_starts, right_positions = positions[right]
+            for ordinal, i, j in _intersect(left_ordinals, right_ordinals):
+                distance = _min_distance(
+                    left_positions[left_starts[i] : left_starts[i + 1]],
+                    right_positions[right_starts[j] : right_starts[j + 1]],
+                    window,
+                )
+                if distance is not None:
+                    scores[ordinal] = scores.get(ordinal, 0.0) + weight / distance
+
+        if not phrase:
+            return self.rank_scores(scores, limit)
+        matches = _phrase_matches(terms, positions) if terms else []
+        ranked = sorted(
+            ((o, scores.get(o, 0.0)) for o in matches), key=lambda x: (-x[1], x[0])
+        )
+        return self.__to_doc_ids(ranked[:limit])
 
-        scores = {}
-        for doc_id in self.docmap:
-            score = 0.0
-            for token in query_tokens:
-                score += self.bm25(doc_id, token)
-            scores[doc_id] = score
+    def proximity_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        window: int = PROXIMITY_WINDOW,
+        phrase: bool = False,
+    ) -> list[dict]:
+        results = []
+        for doc_id, score in self.proximity_rank(query, limit, window, phrase):
+            doc = self.docmap[doc_id]
+            formatted_result = format_search_result(
+                doc_id=doc["id"],
+                title=doc["title"],
+                document=doc["description"],
+                score=score,
+            )
+            results.append(formatted_result)
 
-        sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return results
 
+    def bm25_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        mode: str = DEFAULT_BM25_MODE,
+        filter_query: str | None = None,
+        candidates: Iterable[int] | None = None,
+    ) -> list[dict]:
         results = []
-        for doc_id, score in sorted_docs[:limit]:
+        ranked = self.bm25_rank(query, limit, mode, filter_query, candidates)
+        for doc_id, score in ranked:
             doc = self.docmap[doc_id]
             formatted_result = format_search_result(
                 doc_id=doc["id"],
@@ -149,15 +1163,142 @@ class InvertedIndex:
         return results
 
 
-def build_command() -> None:
+def _intersect(
+    left: Sequence[int], right: Sequence[int]
+) -> Iterator[tuple[int, int, int]]:
+    """(value, left index, right index) for values in both sorted lists.
+
+    The shorter list drives; the longer one is galloped through.
+    """
+    swapped = len(left) > len(right)
+    if swapped:
+        left, right = right, left
+    j = 0
+    for i, value in enumerate(left):
+        j = gallop(right, value, j)
+        if j == len(right):
+            return
+        if right[j] == value:
+            yield (value, j, i) if swapped else (value, i, j)
+
+
+def _min_distance(
+    first: Sequence[int], second: Sequence[int], window: int
+) -> int | None:
+    """Smallest q - p within `window`, for p in first and q > p in second."""
+    best = None
+    j = 0
+    for position in first:
+        j = gallop(second, position + 1, j)
+        if j == len(second):
+            break
+        distance = second[j] - position
+        if distance <= window and (best is None or distance < best):
+            best = distance
+            if best == 1:
+                break
+    return best
+
+
+def _phrase_matches(terms: list[str], positions: dict[str, TermPositions]) -> list[int]:
+    """Ordinals of documents where `terms` occur consecutively, in order."""
+    # intersect the documents of every term, rarest first
+    by_rarity = sorted(set(terms), key=lambda term: len(positions[term][0]))
+    candidates = [
+        (ordinal, [i]) for i, ordinal in enumerate(positions[by_rarity[0]][0])
+    ]
+    for term in by_rarity[1:]:
+        ordinals = positions[term][0]
+        matched, j = [], 0
+        for ordinal, indexes in candidates:
+            j = gallop(ordinals, ordinal, j)
+            if j == len(ordinals):
+                break
+            if ordinals[j] == ordinal:
+                matched.append((ordinal, [*indexes, j]))
+        candidates = matched
+
+    matches = []
+    slots = [by_rarity.index(term) for term in terms]
+    for ordinal, indexes in candidates:
+        doc_positions = []
+        for term, slot in zip(terms, slots):
+            _, starts, term_positions = positions[term]
+            i = indexes[slot]
+            doc_positions.append(term_positions[starts[i] : starts[i + 1]])
+        if _contains_phrase(doc_positions):
+            matches.append(ordinal)
+    return matches
+
+
+def _contains_phrase(doc_positions: list[Sequence[int]]) -> bool:
+    cursors = [0] * len(doc_positions)
+    for start in doc_positions[0]:
+        for offset in range(1, len(doc_positions)):
+            term_positions = doc_positions[offset]
+            cursors[offset] = gallop(term_positions, start + offset, cursors[offset])
+            if cursors[offset] == len(term_positions):
+                return False
+            if term_positions[cursors[offset]] != start + offset:
+                break
+        else:
+            return True
+    return False
+
+
+def _can_reach(bound: float | np.ndarray, threshold: float) -> bool | np.ndarray:
+    # bounds are summed in a different order than exact scores, so allow for
+    # rounding; a tie can still win on docmap order, so ties are not pruned
+    return bound >= threshold - 1e-9 * abs(threshold)
+
+
+def build_command(
+    workers: int = DEFAULT_BUILD_WORKERS, positions: bool = False
+) -> None:
+    idx = InvertedIndex()
+    idx.build(workers, positions)
+    idx.save()
+
+
+def add_command(doc_id: int, title: str, description: str) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.add_document({"id": doc_id, "title": title, "description": description})
+    idx.save()
+
+
+def update_command(doc_id: int, title: str, description: str) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.update_document({"id": doc_id, "title": title, "description": description})
+    idx.save()
+
+
+def delete_command(doc_id: int) -> None:
     idx = InvertedIndex()
-    idx.build()
+    idx.load()
+    idx.delete_document(doc_id)
+    idx.save()
+
+
+def merge_command() -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.merge()
     idx.save()
 
 
 def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+    """Boolean match for queries with operators, else documents matching any term.
+
+    Raises ValueError for a malformed boolean query.
+    """
     idx = InvertedIndex()
     idx.load()
+    if has_boolean_syntax(query):
+        matches = idx.boolean_match(query)
+        return [idx.docmap[idx.doc_ids[o]] for o in itertools.islice(matches, limit)]
+
     query_tokens = tokenize_text(query)
     seen, results = set(), []
     for query_token in query_tokens:
@@ -174,29 +1315,116 @@ def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
     return results
 
 
+def _document_text(doc: dict) -> str:
+    return f"{doc['title']} {doc['description']}"
+
+
+def _file_version(path: str) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _encode_term_postings(
+    term_postings: Iterable[TermPostings], with_positions: bool
+) -> dict[str, array | bytes]:
+    """Compress per-term postings, and positions if asked, into segment sections."""
+    sections = {
+        "term_offsets": array("Q", [0]),
+        "doc_counts": array("I"),
+        "position_offsets": array("Q", [0]),
+    }
+    postings, positions = bytearray(), bytearray()
+    for term_ordinals, term_tfs, term_positions in term_postings:
+        postings += encode_postings(term_ordinals, term_tfs)
+        sections["term_offsets"].append(len(postings))
+        sections["doc_counts"].append(len(term_ordinals))
+        if with_positions:
+            positions += encode_positions(term_positions, term_tfs)
+            sections["position_offsets"].append(len(positions))
+    sections["postings"] = bytes(postings)
+    if with_positions:
+        sections["positions"] = bytes(positions)
+    else:
+        del sections["position_offsets"]
+    return sections
+
+
+def _iter_delta_postings(
+    delta: DeltaSegment,
+) -> Iterator[tuple[str, np.ndarray, np.ndarray, np.ndarray]]:
+    for term_id, term in enumerate(delta.terms):
+        ordinals, tfs = delta.get_postings(term_id)
+        if delta.positions is not None:
+            positions = delta.get_positions(term_id, tfs)
+        else:
+            positions = np.zeros(0, dtype=np.int64)
+        yield term, ordinals, tfs, positions
+
+
+def _token_positions(tokens: list[str]) -> dict[str, list[int]]:
+    token_positions: dict[str, list[int]] = {}
+    for position, token in enumerate(tokens):
+        token_positions.setdefault(token, []).append(position)
+    return token_positions
+
+
+def _index_shard(start: int, texts: list[str], positions: bool = False) -> PartialIndex:
+    postings: dict[str, TermPostings] = {}
+    doc_lengths = array("I")
+    for ordinal, tokens in enumerate(get_analyzer().tokenize_many(texts), start):
+        for token, token_positions in _token_positions(tokens).items():
+            if token not in postings:
+                postings[token] = (array("I"), array("I"), array("I"))
+            postings[token][0].append(ordinal)
+            postings[token][1].append(len(token_positions))
+            if positions:
+                postings[token][2].extend(token_positions)
+        doc_lengths.append(len(tokens))
+    terms = sorted(postings)
+    return terms, [postings[term] for term in terms], doc_lengths
+
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+
+class Analyzer:
+    """Lowercase, strip punctuation, drop stopwords and Porter-stem.
+
+    Stopwords, the translation table and the stemmer are set up once, and
+    stems are memoized in a bounded LRU cache, so one analyzer can be reused
+    for every document and query.
+    """
+
+    def __init__(self, stem_cache_size: int = STEM_CACHE_SIZE) -> None:
+        self.stop_words = frozenset(load_stopwords())
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def tokenize(self, text: str) -> list[str]:
+        stop_words, stem = self.stop_words, self.stem
+        words = text.lower().translate(PUNCTUATION_TABLE).split()
+        return [stem(word) for word in words if word not in stop_words]
+
+    def tokenize_many(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.tokenize(text) for text in texts]
+
+
+@cache
+def get_analyzer() -> Analyzer:
+    return Analyzer()
+
+
 def preprocess_text(text: str) -> str:
     text = text.lower()
-    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = text.translate(PUNCTUATION_TABLE)
     return text
 
 
 def tokenize_text(text: str) -> list[str]:
-    text = preprocess_text(text)
-    tokens = text.split()
-    valid_tokens = []
-    for token in tokens:
-        if token:
-            valid_tokens.append(token)
-    stop_words = load_stopwords()
-    filtered_words = []
-    for word in valid_tokens:
-        if word not in stop_words:
-            filtered_words.append(word)
-    stemmer = PorterStemmer()
-    stemmed_words = []
-    for word in filtered_words:
-        stemmed_words.append(stemmer.stem(word))
-    return stemmed_words
+    return get_analyzer().tokenize(text)
 
 
 def tf_command(doc_id: int, term: str) -> int:
@@ -231,7 +1459,158 @@ def tfidf_command(doc_id: int, term: str) -> float:
     return idx.get_tf_idf(doc_id, term)
 
 
-def bm25search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def bm25search_command(
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    mode: str = DEFAULT_BM25_MODE,
+    filter_query: str | None = None,
+) -> list[dict]:
     idx = InvertedIndex()
     idx.load()
-    return idx.bm25_search(query, limit)
+    return idx.bm25_search(query, limit, mode, filter_query)
+
+
+def proximity_search_command(
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    window: int = PROXIMITY_WINDOW,
+    phrase: bool = False,
+) -> list[dict]:
+    idx = InvertedIndex()
+    idx.load()
+    return idx.proximity_search(query, limit, window, phrase)
+
+
+def build_benchmark_command(worker_counts: list[int] | None = None) -> dict:
+    if not worker_counts:
+        worker_counts = [1, 2, 4]
+
+    timings = {}
+    identical = True
+    reference = None
+    for workers in worker_counts:
+        idx = InvertedIndex()
+        start = time.perf_counter()
+        # always shard, to show whether workers pay off at this catalog size
+        idx.build(workers, min_parallel_docs=0)
+        timings[workers] = time.perf_counter() - start
+
+        built = (
+            idx.terms,
+            idx.term_offsets,
+            idx.doc_counts,
+            idx.postings,
+            idx.doc_lengths,
+            idx.doc_norms,
+            idx.idf,
+            idx.block_max_scores,
+        )
+        if reference is None:
+            reference = built
+        elif built != reference:
+            identical = False
+
+    baseline = timings[worker_counts[0]]
+    return {
+        "documents": len(idx.doc_ids),
+        "parallel_min_docs": PARALLEL_BUILD_MIN_DOCS,
+        "timings_seconds": timings,
+        "speedups": {workers: baseline / t for workers, t in timings.items()},
+        "identical": identical,
+    }
+
+
+def analyzer_benchmark_command(repeat: int = 1) -> dict:
+    movies = load_movies()
+    texts = [f"{m['title']} {m['description']}" for m in movies]
+
+    # a fresh analyzer per text repeats the setup tokenize_text used to do on
+    # every call: read stopwords, build the table and a new stemmer
+    start = time.perf_counter()
+    for _ in range(repeat):
+        per_call_tokens = [Analyzer(stem_cache_size=0).tokenize(t) for t in texts]
+    per_call_seconds = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        batch_tokens = Analyzer().tokenize_many(texts)
+    batch_seconds = (time.perf_counter() - start) / repeat
+
+    return {
+        "documents": len(texts),
+        "tokens": sum(len(tokens) for tokens in batch_tokens),
+        "per_call_seconds": per_call_seconds,
+        "batch_seconds": batch_seconds,
+        "speedup": per_call_seconds / batch_seconds,
+        "identical": per_call_tokens == batch_tokens,
+    }
+
+
+def bm25_batch_benchmark_command(
+    queries: list[str] | None = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    repeat: int = 10,
+) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    if not queries:
+        queries = [case["query"] for case in load_golden_dataset()["test_cases"]]
+    query_log = queries * repeat
+
+    start = time.perf_counter()
+    per_query = [idx.bm25_rank(query, limit) for query in query_log]
+    per_query_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    idx.get_bm25_matrix()
+    matrix_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = idx.bm25_rank_batch(query_log, limit)
+    batch_seconds = time.perf_counter() - start
+
+    mismatches = sorted(
+        {query for query, a, b in zip(query_log, per_query, batch) if a != b}
+    )
+    return {
+        "queries": len(query_log),
+        "limit": limit,
+        "matrix_seconds": matrix_seconds,
+        "per_query_qps": len(query_log) / per_query_seconds,
+        "batch_qps": len(query_log) / batch_seconds,
+        "speedup": per_query_seconds / batch_seconds,
+        "mismatches": mismatches,
+    }
+
+
+def bm25_benchmark_command(
+    queries: list[str] | None = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    repeat: int = 3,
+) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    if not queries:
+        queries = [case["query"] for case in load_golden_dataset()["test_cases"]]
+
+    timings = {}
+    rankings = {}
+    for mode in BM25_MODES:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rankings[mode] = [idx.bm25_rank(query, limit, mode) for query in queries]
+        elapsed = time.perf_counter() - start
+        timings[mode] = elapsed * 1000 / (repeat * len(queries))
+
+    mismatches = []
+    for i, query in enumerate(queries):
+        if rankings["pruned"][i] != rankings["exhaustive"][i]:
+            mismatches.append(query)
+
+    return {
+        "queries": len(queries),
+        "limit": limit,
+        "timings_ms": timings,
+        "speedup": timings["exhaustive"] / timings["pruned"],
+        "mismatches": mismatches,
+    }
@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+
+from .search_utils import MICRO_BATCH_SIZE, MICRO_BATCH_WAIT_MS
+
+
+class MicroBatcher:
+    """Runs concurrent calls of a batched function as one call.
+
+    `submit` queues a request's items and returns a future for their outputs.
+    A worker thread takes the oldest request, collects more for at most
+    `max_wait_ms` or until `max_batch_size` items, calls `fn` once on all of
+    them and resolves each future with its slice of the outputs. A request
+    larger than `max_batch_size` runs alone, unsplit. A request that finds
+    no other one queued is the only caller in flight and runs at once,
+    without waiting for company. The thread starts on the first submit.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[list], Sequence],
+        max_batch_size: int = MICRO_BATCH_SIZE,
+        max_wait_ms: float = MICRO_BATCH_WAIT_MS,
+    ) -> None:
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.items = 0
+
+    def __call__(self, items: list) -> Sequence:
+        return self.submit(items).result()
+
+    def submit(self, items: list) -> Future:
+        future = Future()
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.requests.put((list(items), future))
+        return future
+
+    def _run(self) -> None:
+        held = None
+        while True:
+            request = held or self.requests.get()
+            held = None
+            batch = [request]
+            size = len(request[0])
+            if self.requests.empty():
+                self._run_batch(batch)
+                continue
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while size < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=deadline - time.monotonic())
+                except (queue.Empty, ValueError):
+                    # ValueError: the deadline has already passed
+                    break
+                if size + len(request[0]) > self.max_batch_size:
+                    held = request
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list[tuple[list, Future]]) -> None:
+        items = [item for request_items, _ in batch for item in request_items]
+        try:
+            outputs = self.fn(items)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += len(items)
+        start = 0
+        for request_items, future in batch:
+            future.set_result(outputs[start : start + len(request_items)])
+            start += len(request_items)
@@ -0,0 +1,134 @@
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from .search_utils import ONNX_CACHE_DIR, ONNX_QUANTIZATION_CONFIG, ONNX_THREADS
+
+# (class, name, backend, threads) -> loaded model, shared by everything in
+# the process
+_models = {}
+_load_stats = {}
+_lock = threading.Lock()
+
+
+def get_sentence_transformer(
+    name: str, backend: str = "torch", threads: int = ONNX_THREADS
+) -> SentenceTransformer:
+    return _get_model(SentenceTransformer, name, backend, threads)
+
+
+def get_cross_encoder(
+    name: str, backend: str = "torch", threads: int = ONNX_THREADS
+) -> CrossEncoder:
+    return _get_model(CrossEncoder, name, backend, threads)
+
+
+def model_stats() -> list[dict]:
+    """Load time and resident memory added by each model loaded so far.
+
+    Memory is the process's resident set growth across the load, so it
+    includes anything else the load pulled in, such as the framework itself
+    for the first model. An ONNX backend that could not be loaded has no
+    entry of its own: it shares the torch model.
+    """
+    with _lock:
+        return [dict(stats) for stats in _load_stats.values()]
+
+
+def _get_model(cls, name: str, backend: str, threads: int):
+    if backend == "torch":
+        threads = ONNX_THREADS
+    key = (cls, name, backend, threads)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        if key not in _models:
+            _models[key] = _load(cls, name, backend, threads)
+        return _models[key]
+
+
+def _load(cls, name: str, backend: str, threads: int):
+    torch_key = (cls, name, "torch", ONNX_THREADS)
+    if backend != "torch":
+        try:
+            return _timed_load(cls, name, backend, threads)
+        except Exception as e:
+            # typically onnxruntime/optimum not installed, or a library too
+            # old to export this kind of model
+            print(
+                f"{name}: {backend} backend unavailable ({e}); using torch",
+                file=sys.stderr,
+            )
+            if torch_key in _models:
+                return _models[torch_key]
+    model = _timed_load(cls, name, "torch", ONNX_THREADS)
+    _models[torch_key] = model
+    return model
+
+
+def _timed_load(cls, name: str, backend: str, threads: int):
+    rss_before = _resident_bytes()
+    start = time.perf_counter()
+    if backend == "torch":
+        model = cls(name)
+    else:
+        model = _load_onnx(cls, name, backend == "onnx-int8", threads)
+    _load_stats[(cls, name, backend, threads)] = {
+        "name": name,
+        "kind": cls.__name__,
+        "backend": backend,
+        "threads": threads,
+        "load_seconds": time.perf_counter() - start,
+        "resident_bytes": max(0, _resident_bytes() - rss_before),
+    }
+    return model
+
+
+def _load_onnx(cls, name: str, quantize: bool, threads: int):
+    """Run `name` through ONNX Runtime, exporting it into the cache once.
+
+    With `quantize`, the exported graph's weights are also dynamically
+    quantized to int8, again once.
+    """
+    import onnxruntime
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    export_dir = os.path.join(ONNX_CACHE_DIR, re.sub(r"[^\w.-]", "_", name))
+    file_name = os.path.join("onnx", "model.onnx")
+    if not os.path.exists(os.path.join(export_dir, file_name)):
+        cls(name, backend="onnx").save_pretrained(export_dir)
+    if quantize:
+        quantized_name = os.path.join(
+            "onnx", f"model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx"
+        )
+        if not os.path.exists(os.path.join(export_dir, quantized_name)):
+            export_dynamic_quantized_onnx_model(
+                cls(export_dir, backend="onnx"), ONNX_QUANTIZATION_CONFIG, export_dir
+            )
+        file_name = quantized_name
+
+    session_options = onnxruntime.SessionOptions()
+    if threads > 0:
+        session_options.intra_op_num_threads = threads
+    return cls(
+        export_dir,
+        backend="onnx",
+        model_kwargs={"file_name": file_name, "session_options": session_options},
+    )
+
+
+def _resident_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no procfs: the peak resident size still grows with each load
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
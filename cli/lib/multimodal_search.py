@@ -1,9 +1,17 @@
 from PIL import Image
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
-from .semantic_search import cosine_similarity
-from .search_utils import load_movies
+from .embedding_build import EmbeddingEncoder, update_embeddings
+from .model_registry import get_sentence_transformer
+from .quantization import load_or_create_quantized, rescore_shortlist
+from .search_utils import (
+    CLIP_TEXT_EMBEDDINGS_PATH,
+    DEFAULT_EMBED_WORKERS,
+    DEFAULT_SEARCH_LIMIT,
+    QUANTIZED_RESCORE_FACTOR,
+    load_movies,
+)
+from .vector_index import normalize_embeddings, score_rows, top_k_indices
 
 
 class MultimodalSearch:
@@ -11,15 +19,32 @@ class MultimodalSearch:
         self,
         documents: list[dict],
         model_name="clip-ViT-B-32",
+        quantization: str | None = None,
+        workers: int = DEFAULT_EMBED_WORKERS,
     ):
         self.docs = documents
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
         self.texts = []
 
         for doc in self.docs:
             self.texts.append(f"{doc["title"]}: {doc["description"]}")
 
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        # unit-length rows, memory-mapped from the cache
+        self.text_embeddings = update_embeddings(
+            CLIP_TEXT_EMBEDDINGS_PATH,
+            self.texts,
+            EmbeddingEncoder(model_name, workers),
+        )
+        self.quantized_text_embeddings = None
+        if quantization is not None:
+            self.quantized_text_embeddings = load_or_create_quantized(
+                CLIP_TEXT_EMBEDDINGS_PATH, self.text_embeddings, quantization
+            )
+
+    @property
+    def model(self):
+        """The shared model, loaded on first use."""
+        return get_sentence_transformer(self.model_name)
 
     def embed_image(self, img_path: str) -> np.ndarray:
         img = Image.open(img_path)
@@ -29,24 +54,34 @@ class MultimodalSearch:
         return arrays[0]
 
     def search_with_image(self, img_path: str) -> list[dict]:
-        img_embedding = self.embed_image(img_path)
+        img_embedding = normalize_embeddings(self.embed_image(img_path))
+
+        if self.quantized_text_embeddings is None:
+            scores = score_rows(self.text_embeddings, img_embedding)
+            doc_indices = top_k_indices(scores, DEFAULT_SEARCH_LIMIT)
+            scores = scores[doc_indices]
+        else:
+            shortlist, shortlist_scores = rescore_shortlist(
+                self.quantized_text_embeddings,
+                self.text_embeddings,
+                img_embedding,
+                DEFAULT_SEARCH_LIMIT * QUANTIZED_RESCORE_FACTOR,
+            )
+            order = top_k_indices(shortlist_scores, DEFAULT_SEARCH_LIMIT)
+            doc_indices, scores = shortlist[order], shortlist_scores[order]
 
         results = []
-        for i, text_embedding in enumerate(self.text_embeddings):
-            cosine_score = cosine_similarity(text_embedding, img_embedding)
-
+        for doc_idx, cosine_score in zip(doc_indices, scores):
             results.append(
                 {
-                    "id": self.docs[i]["id"],
-                    "title": self.docs[i]["title"],
-                    "description": self.docs[i]["description"],
+                    "id": self.docs[doc_idx]["id"],
+                    "title": self.docs[doc_idx]["title"],
+                    "description": self.docs[doc_idx]["description"],
                     "similarity_score": f"{cosine_score:.3f}",
                 }
             )
 
-        return list(sorted(results, key=lambda x: x["similarity_score"], reverse=True))[
-            :5
-        ]
+        return results
 
 
 def verify_image_embedding(img_path: str) -> None:
@@ -57,8 +92,8 @@ def verify_image_embedding(img_path: str) -> None:
     print(f"Embedding shape: {embedding.shape[0]} dimensions")
 
 
-def image_search_command(img_path: str) -> list[dict]:
+def image_search_command(img_path: str, quantization: str | None = None) -> list[dict]:
     docs = load_movies()
-    multimodal_search = MultimodalSearch(docs)
+    multimodal_search = MultimodalSearch(docs, quantization=quantization)
 
     return multimodal_search.search_with_image(img_path)
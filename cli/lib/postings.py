@@ -0,0 +1,96 @@
+from bisect import bisect_left
+from collections.abc import Iterable, Sequence
+
+import numpy as np
+
+
+def encode_varints(values: Iterable[int], out: bytearray) -> None:
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(data: bytes | memoryview) -> np.ndarray:
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # every value ends on the first byte without the continuation bit
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    value_index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(raw.size) - starts[value_index]) * 7
+    payload = (raw & 0x7F).astype(np.int64) << shifts
+    return np.add.reduceat(payload, starts)
+
+
+def encode_postings(doc_ids: Sequence[int], tfs: Sequence[int]) -> bytearray:
+    """Encode a sorted postings list as varint doc id gaps followed by its tfs."""
+    out = bytearray()
+    previous = 0
+    gaps = []
+    for doc_id in doc_ids:
+        gaps.append(doc_id - previous)
+        previous = doc_id
+    encode_varints(gaps, out)
+    encode_varints(tfs, out)
+    return out
+
+
+def encode_positions(positions: Sequence[int], tfs: Sequence[int]) -> bytearray:
+    """Encode each document's sorted term positions as varint gaps.
+
+    `positions` holds tfs[i] positions for the i-th posting, back to back; gaps
+    restart at every document.
+    """
+    out = bytearray()
+    gaps = []
+    i = 0
+    for tf in tfs:
+        previous = 0
+        for position in positions[i : i + tf]:
+            gaps.append(position - previous)
+            previous = position
+        i += tf
+    encode_varints(gaps, out)
+    return out
+
+
+def decode_positions(data: bytes | memoryview, tfs: np.ndarray) -> np.ndarray:
+    gaps = decode_varints(data)
+    totals = np.cumsum(gaps)
+    # undo the running sum at every document boundary
+    starts = np.cumsum(tfs) - tfs
+    return totals - np.repeat(totals[starts] - gaps[starts], tfs)
+
+
+def decode_postings_array(
+    data: bytes | memoryview, count: int
+) -> tuple[np.ndarray, np.ndarray]:
+    values = decode_varints(data)
+    return np.cumsum(values[:count]), values[count:]
+
+
+def decode_postings(
+    data: bytes | memoryview, count: int
+) -> tuple[list[int], list[int]]:
+    doc_ids, tfs = decode_postings_array(data, count)
+    return doc_ids.tolist(), tfs.tolist()
+
+
+def gallop(values: Sequence[int], target: int, lo: int = 0) -> int:
+    """Index of the first value >= target at or after `lo`.
+
+    Probes lo, lo + 1, lo + 3, lo + 7, ... before a binary search, so walking
+    a long sorted list with increasing targets skips most of it.
+    """
+    step, hi = 1, lo
+    while hi < len(values) and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(values, target, lo, min(hi, len(values)))
@@ -0,0 +1,282 @@
+import os
+
+import numpy as np
+
+from .search_utils import PCA_DIMENSIONS, PQ_GROUPS
+from .vector_index import normalize_embeddings, top_k_indices
+
+# rows decoded per block while scanning int8 codes
+SCAN_BATCH_SIZE = 16384
+PQ_CENTROIDS = 256
+# k-means and PCA train on at most this many vectors
+PQ_TRAINING_SAMPLES = 16384
+
+
+class Int8Vectors:
+    """Scalar quantization: one int8 code per dimension, one scale per dimension.
+
+    Four times smaller than float32. Scores are dot products with the
+    dequantized vectors, computed without materializing them.
+    """
+
+    method = "int8"
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray) -> None:
+        self.codes = codes
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> "Int8Vectors":
+        scales = np.abs(vectors).max(axis=0) / 127
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    def scores(self, query: np.ndarray, ids: np.ndarray | None = None) -> np.ndarray:
+        codes = self.codes if ids is None else self.codes[ids]
+        scaled_query = query * self.scales
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BATCH_SIZE):
+            block = codes[start : start + SCAN_BATCH_SIZE].astype(np.float32)
+            scores[start : start + len(block)] = block @ scaled_query
+        return scores
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes, "scales": self.scales}
+
+
+class PQVectors:
+    """Product quantization: one byte per group of dimensions.
+
+    Each group has its own codebook of PQ_CENTROIDS centroids; a query
+    precomputes its dot product with every centroid, so scoring a vector is
+    one table lookup per group. Codebooks are stored side by side as a
+    (PQ_CENTROIDS, dim) matrix, with `group_offsets` marking the columns of
+    each group.
+    """
+
+    method = "pq"
+
+    def __init__(
+        self, codes: np.ndarray, codebooks: np.ndarray, group_offsets: np.ndarray
+    ) -> None:
+        self.codes = codes
+        self.codebooks = codebooks
+        self.group_offsets = group_offsets
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    @classmethod
+    def fit(
+        cls, vectors: np.ndarray, groups: int, iterations: int = 10, seed: int = 0
+    ) -> "PQVectors":
+        rng = np.random.default_rng(seed)
+        dim = vectors.shape[1]
+        groups = min(groups, dim)
+        group_offsets = np.array(
+            [len(part) for part in np.array_split(np.arange(dim), groups)]
+        ).cumsum()
+        group_offsets = np.concatenate([[0], group_offsets])
+
+        sample = vectors
+        if len(vectors) > PQ_TRAINING_SAMPLES:
+            rows = rng.choice(len(vectors), PQ_TRAINING_SAMPLES, replace=False)
+            sample = vectors[np.sort(rows)]
+
+        centroid_count = min(PQ_CENTROIDS, len(sample))
+        codebooks = np.zeros((PQ_CENTROIDS, dim), dtype=np.float32)
+        codes = np.empty((len(vectors), groups), dtype=np.uint8)
+        for group in range(groups):
+            columns = slice(group_offsets[group], group_offsets[group + 1])
+            centroids = _kmeans(sample[:, columns], centroid_count, iterations, rng)
+            codebooks[:centroid_count, columns] = centroids
+            codes[:, group] = _nearest(vectors[:, columns], centroids)
+        return cls(codes, codebooks, group_offsets)
+
+    def scores(self, query: np.ndarray, ids: np.ndarray | None = None) -> np.ndarray:
+        codes = self.codes if ids is None else self.codes[ids]
+        # table[group, centroid]: the query's dot product with that centroid
+        table = np.add.reduceat(
+            self.codebooks * query, self.group_offsets[:-1], axis=1
+        ).T.astype(np.float32)
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for group in range(len(table)):
+            scores += table[group][codes[:, group]]
+        return scores
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "codes": self.codes,
+            "codebooks": self.codebooks,
+            "group_offsets": self.group_offsets,
+        }
+
+
+class PCAVectors:
+    """Projections onto the top principal components of the vectors.
+
+    A 64-d copy of 384-d vectors is a sixth of the size, and scanning it
+    reads a sixth of the memory. Since x = mean + components.T @ projection
+    plus a residual, a score is mean @ query plus the projection's dot
+    product with the projected query; only the residual is lost.
+    """
+
+    method = "pca"
+
+    def __init__(
+        self, projections: np.ndarray, components: np.ndarray, mean: np.ndarray
+    ) -> None:
+        self.projections = projections
+        self.components = components
+        self.mean = mean
+
+    def __len__(self) -> int:
+        return len(self.projections)
+
+    @property
+    def nbytes(self) -> int:
+        return self.projections.nbytes + self.components.nbytes
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dimensions: int, seed: int = 0) -> "PCAVectors":
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > PQ_TRAINING_SAMPLES:
+            rows = rng.choice(len(vectors), PQ_TRAINING_SAMPLES, replace=False)
+            sample = vectors[np.sort(rows)]
+        sample = np.asarray(sample, dtype=np.float32)
+        mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        components = np.ascontiguousarray(vt[:dimensions], dtype=np.float32)
+
+        projections = np.empty((len(vectors), len(components)), dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_BATCH_SIZE):
+            block = np.asarray(vectors[start : start + SCAN_BATCH_SIZE], np.float32)
+            projections[start : start + len(block)] = (block - mean) @ components.T
+        return cls(projections, components, mean)
+
+    def scores(self, query: np.ndarray, ids: np.ndarray | None = None) -> np.ndarray:
+        projections = self.projections if ids is None else self.projections[ids]
+        return projections @ (self.components @ query) + self.mean @ query
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "projections": self.projections,
+            "components": self.components,
+            "mean": self.mean,
+        }
+
+
+def quantize(vectors: np.ndarray, method: str, pq_groups: int = PQ_GROUPS):
+    if method == "int8":
+        return Int8Vectors.fit(vectors)
+    if method == "pq":
+        return PQVectors.fit(vectors, pq_groups)
+    if method == "pca":
+        return PCAVectors.fit(vectors, PCA_DIMENSIONS)
+    raise ValueError(f"unknown quantization method '{method}'")
+
+
+def load_or_create_quantized(path: str, embeddings: np.ndarray, method: str):
+    """Codes for the normalized `embeddings` saved at `path`, cached beside them.
+
+    Cached codes older than the embeddings file, or of a different length,
+    are refitted.
+    """
+    codes_path = quantized_path(path, method)
+    fresh = os.path.exists(codes_path) and (
+        os.path.getmtime(codes_path) >= os.path.getmtime(path)
+    )
+    if fresh:
+        quantized = load_quantized(codes_path, method)
+        if len(quantized) == len(embeddings):
+            return quantized
+
+    quantized = quantize(normalize_embeddings(embeddings), method)
+    save_quantized(codes_path, quantized)
+    return quantized
+
+
+def quantized_path(path: str, method: str) -> str:
+    """Where the codes for the embeddings saved at `path` are cached."""
+    return f"{os.path.splitext(path)[0]}.{method}.npz"
+
+
+def save_quantized(path: str, quantized) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez(f, **quantized.arrays())
+
+
+def load_quantized(path: str, method: str):
+    with np.load(path) as data:
+        if method == "int8":
+            return Int8Vectors(data["codes"], data["scales"])
+        if method == "pq":
+            return PQVectors(data["codes"], data["codebooks"], data["group_offsets"])
+        if method == "pca":
+            return PCAVectors(data["projections"], data["components"], data["mean"])
+    raise ValueError(f"unknown quantization method '{method}'")
+
+
+def rescore_shortlist(
+    quantized,
+    vectors: np.ndarray,
+    query: np.ndarray,
+    size: int,
+    ids: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Exact cosine scores for the `size` best rows by quantized score.
+
+    `vectors` are the full-precision embeddings, typically memory-mapped, so
+    only shortlisted rows are read. `ids` restricts the scan to those rows.
+    Returns the shortlisted row ids in ascending order with their scores.
+    """
+    approximate = quantized.scores(query, ids)
+    shortlist = np.sort(top_k_indices(approximate, size))
+    if ids is not None:
+        shortlist = ids[shortlist]
+    rows = np.asarray(vectors[shortlist], dtype=np.float32)
+    norms = np.linalg.norm(rows, axis=1)
+    scores = np.divide(
+        rows @ query, norms, out=np.zeros(len(rows), dtype=np.float32), where=norms > 0
+    )
+    return shortlist, scores
+
+
+def _kmeans(
+    vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)[:, np.newaxis]
+        # an empty cluster keeps its old centroid
+        np.divide(sums, counts, out=centroids, where=counts > 0)
+    return centroids
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin of squared distance, dropping the per-vector |x|^2 term
+    half_norms = (centroids**2).sum(axis=1) / 2
+    assignments = np.empty(len(vectors), dtype=np.uint8)
+    for start in range(0, len(vectors), SCAN_BATCH_SIZE):
+        batch = vectors[start : start + SCAN_BATCH_SIZE]
+        assignments[start : start + len(batch)] = np.argmax(
+            batch @ centroids.T - half_norms, axis=1
+        )
+    return assignments
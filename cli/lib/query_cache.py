@@ -0,0 +1,200 @@
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+from contextlib import contextmanager
+
+import numpy as np
+
+from .search_utils import QUERY_CACHE_DIR, QUERY_CACHE_SIZE
+
+KEY_SIZE = 16
+
+
+class QueryEmbeddingCache:
+    """Embeddings of query texts for one model, in memory and on disk.
+
+    Recently used embeddings sit in an LRU dict. Every embedding is also
+    appended to `<model>.f32`, a flat float32 file read through a memory map,
+    and its key to `<model>.keys`, one "<row> <hex digest>" line per row
+    after a header line with the dimension.
+
+    Appends hold an exclusive lock on `<model>.lock`, so threads and
+    processes can share the files. A row's key is written only once its
+    vector is, so a key line never points at a missing vector; a crash at
+    worst leaves a vector without a key, or a cut-off key line, and both
+    are skipped.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str = QUERY_CACHE_DIR,
+        capacity: int = QUERY_CACHE_SIZE,
+    ) -> None:
+        slug = re.sub(r"[^\w.-]", "_", model_name)
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.keys_path = os.path.join(cache_dir, f"{slug}.keys")
+        self.lock_path = os.path.join(cache_dir, f"{slug}.lock")
+        self.capacity = capacity
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # key -> row in the vectors file, read from the keys file up to
+        # keys_offset
+        self.rows = {}
+        self.keys_offset = 0
+        self.dim = None
+        self.vectors = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": len(self.rows),
+            }
+
+    def embed(
+        self, texts: list[str], encode: Callable[[list[str]], np.ndarray]
+    ) -> np.ndarray:
+        """Embeddings of `texts`, calling `encode` once for all uncached ones.
+
+        The lock is not held while encoding, so concurrent callers can share
+        a micro-batched encode; a text they both missed is stored once.
+        """
+        keys = [query_key(text) for text in texts]
+        found = {}
+        with self.lock:
+            self._read_new_keys()
+            for key in keys:
+                if key not in found:
+                    vector = self._lookup(key)
+                    if vector is not None:
+                        found[key] = vector
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            with self.lock:
+                self._append(list(missing), vectors)
+                for key, vector in zip(missing, vectors):
+                    found[key] = vector
+                    self._remember(key, vector)
+
+        return np.stack([found[key] for key in keys])
+
+    def _lookup(self, key: str) -> np.ndarray | None:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return vector
+
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self.vectors is None or row >= len(self.vectors):
+            row_count = os.path.getsize(self.vectors_path) // self._row_bytes()
+            self.vectors = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(row_count, self.dim),
+            )
+        vector = np.array(self.vectors[row])
+        self._remember(key, vector)
+        self.disk_hits += 1
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(np.float32).itemsize
+
+    def _read_new_keys(self) -> None:
+        """Pick up key lines added since the last read, by any process."""
+        try:
+            with open(self.keys_path, "rb") as f:
+                f.seek(self.keys_offset)
+                content = f.read()
+        except FileNotFoundError:
+            return
+        # a line still being written, or cut short by a crash, has no
+        # newline yet and is left for the next read
+        end = content.rfind(b"\n") + 1
+        lines = content[:end].decode().split("\n")[:-1]
+        self.keys_offset += end
+        if self.dim is None and lines:
+            self.dim = int(lines.pop(0))
+        for line in lines:
+            row, _, key = line.partition(" ")
+            # the remains of a cut-off line fail to parse and are skipped
+            if row.isdigit() and len(key) == 2 * KEY_SIZE:
+                self.rows[key] = int(row)
+
+    def _append(self, keys: list[str], vectors: np.ndarray) -> None:
+        os.makedirs(os.path.dirname(self.keys_path), exist_ok=True)
+        with _file_lock(self.lock_path):
+            self._read_new_keys()
+            # another caller may have stored some of these in the meantime
+            new = [i for i, key in enumerate(keys) if key not in self.rows]
+            if not new:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.keys_path, "w") as f:
+                    f.write(f"{self.dim}\n")
+                self.keys_offset = len(f"{self.dim}\n")
+
+            # rows go where the file ends; a partial row left by a crash
+            # has no key and is overwritten
+            with open(self.vectors_path, "ab") as f:
+                first_row = f.tell() // self._row_bytes()
+                f.truncate(first_row * self._row_bytes())
+                f.write(vectors[new].tobytes())
+            lines = [f"{first_row + i} {keys[j]}\n" for i, j in enumerate(new)]
+            with open(self.keys_path, "r+") as f:
+                f.seek(0, os.SEEK_END)
+                # end a line cut off by a crash, so it can't swallow ours
+                if f.tell() > self.keys_offset:
+                    lines.insert(0, "\n")
+                f.writelines(lines)
+            self._read_new_keys()
+
+
+@contextmanager
+def _file_lock(path: str):
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def normalize_query(text: str) -> str:
+    """Unicode-normalized text with runs of whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def query_key(text: str) -> str:
+    digest = hashlib.blake2b(normalize_query(text).encode(), digest_size=KEY_SIZE)
+    return digest.hexdigest()
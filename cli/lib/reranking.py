@@ -4,13 +4,18 @@ from time import sleep
 
 from dotenv import load_dotenv
 from google import genai
-from sentence_transformers import CrossEncoder
+
+from .micro_batcher import MicroBatcher
+from .model_registry import get_cross_encoder
+from .search_utils import CROSS_ENCODER_MODEL, ONNX_THREADS
 
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=api_key)
 model = "gemini-2.0-flash"
-cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+# (backend, onnx threads) -> batcher; pairs from concurrent reranks share
+# one forward pass, and the model is only loaded by the first rerank
+cross_encoder_batchers = {}
 
 
 def llm_rerank_individual(
@@ -85,13 +90,28 @@ Return ONLY the IDs in order of relevance (best match first). Return a valid JSO
 
 
 def cross_encoder_rerank(
-    query: str, documents: list[dict], limit: int = 5
+    query: str,
+    documents: list[dict],
+    limit: int = 5,
+    backend: str = "torch",
+    onnx_threads: int = ONNX_THREADS,
 ) -> list[dict]:
     pairs = []
     for doc in documents:
         pairs.append([query, f"{doc.get('title', '')} - {doc.get('document', '')}"])
 
-    scores = cross_encoder.predict(pairs)
+    key = (backend, onnx_threads)
+    batcher = cross_encoder_batchers.get(key)
+    if batcher is None:
+        batcher = cross_encoder_batchers.setdefault(
+            key,
+            MicroBatcher(
+                lambda pairs: get_cross_encoder(
+                    CROSS_ENCODER_MODEL, backend, onnx_threads
+                ).predict(pairs)
+            ),
+        )
+    scores = batcher(pairs)
 
     for doc, score in zip(documents, scores):
         doc["crossencoder_score"] = float(score)
@@ -101,13 +121,18 @@ def cross_encoder_rerank(
 
 
 def rerank(
-    query: str, documents: list[dict], method: str = "batch", limit: int = 5
+    query: str,
+    documents: list[dict],
+    method: str = "batch",
+    limit: int = 5,
+    backend: str = "torch",
+    onnx_threads: int = ONNX_THREADS,
 ) -> list[dict]:
     if method == "individual":
         return llm_rerank_individual(query, documents, limit)
     if method == "batch":
         return llm_rerank_batch(query, documents, limit)
     if method == "cross_encoder":
-        return cross_encoder_rerank(query, documents, limit)
+        return cross_encoder_rerank(query, documents, limit, backend, onnx_threads)
     else:
         return documents[:limit]
@@ -5,6 +5,14 @@ from typing import Any
 DEFAULT_ALPHA = 0.5
 RRF_K = 60
 SEARCH_MULTIPLIER = 5
+# results each hybrid leg contributes to fusion, per result returned
+HYBRID_SEARCH_FACTOR = 500
+# rescore mode: one leg picks this many candidates per result and the other
+# scores only those
+RESCORE_SOURCES = ("bm25", "semantic")
+HYBRID_RESCORE_FACTOR = 50
+# run once by HybridSearch.warm_up to load models and fault in index pages
+WARM_UP_QUERY = "movie"
 
 DEFAULT_SEARCH_LIMIT = 5
 DOCUMENT_PREVIEW_LENGTH = 100
@@ -12,6 +20,22 @@ SCORE_PRECISION = 3
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+BM25_BLOCK_SIZE = 64
+# queries scored per sparse product; each needs a dense row of doc scores
+BM25_BATCH_SIZE = 256
+BM25_MODES = ("exhaustive", "pruned")
+DEFAULT_BM25_MODE = "exhaustive"
+STEM_CACHE_SIZE = 65536
+DEFAULT_BUILD_WORKERS = 1
+# smaller catalogs build serially whatever the worker count: starting the
+# pool and pickling shard postings back cost more than the stemming saved
+PARALLEL_BUILD_MIN_DOCS = 20000
+# query terms this many tokens apart or closer, in query order, boost BM25
+PROXIMITY_WINDOW = 5
+PROXIMITY_WEIGHT = 1.0
+# save() merges delta segments back into the base past either limit
+MAX_DELTA_SEGMENTS = 8
+MAX_DELETED_FRACTION = 0.25
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
@@ -23,10 +47,53 @@ CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 1
 DEFAULT_SEMANTIC_CHUNK_SIZE = 4
-
+# "tokens" packs sentences up to the model's max_seq_length, repeating up to
+# DEFAULT_CHUNK_OVERLAP_TOKENS tokens of trailing sentences; "sentences"
+# groups DEFAULT_SEMANTIC_CHUNK_SIZE sentences
+CHUNKERS = ("tokens", "sentences")
+# used when neither the caller nor the cached chunk metadata names a chunker
+DEFAULT_CHUNKER = "sentences"
+DEFAULT_CHUNK_OVERLAP_TOKENS = 32
+# IVF lists scanned per query in approximate chunk search
+DEFAULT_IVF_NPROBE = 8
+QUANTIZATION_METHODS = ("int8", "pq", "pca")
+# product quantization stores one byte per group of dimensions
+PQ_GROUPS = 96
+# "pca" keeps float32 projections onto this many principal components
+PCA_DIMENSIONS = 64
+# quantized scans keep this many candidates per result for exact re-scoring
+QUANTIZED_RESCORE_FACTOR = 10
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+# "onnx" runs models through ONNX Runtime, "onnx-int8" with dynamically
+# quantized weights; exports are cached under ONNX_CACHE_DIR. A thread count
+# of 0 leaves it to ONNX Runtime.
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_CACHE_DIR = os.path.join(CACHE_DIR, "onnx")
+ONNX_QUANTIZATION_CONFIG = "avx2"
+ONNX_THREADS = 0
+
+# query encodes from concurrent requests are batched up to this many items,
+# waiting at most this long for a batch to fill
+MICRO_BATCH_SIZE = 64
+MICRO_BATCH_WAIT_MS = 2
+# how a movie's chunk scores combine into its score; "top-m" sums the best m
+CHUNK_POOLING_MODES = ("max", "mean", "top-m")
+DEFAULT_POOLING_TOP_M = 2
+
+# embedding caches hold unit-length rows; "float16" halves them on disk and in
+# the page cache, and scoring still accumulates in float32
+EMBEDDING_CACHE_DTYPE = "float32"
+# texts per encode call when building embeddings, and encoder processes
+EMBED_BATCH_SIZE = 256
+DEFAULT_EMBED_WORKERS = 1
 MOVIE_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.npy")
 CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
+CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.npz")
+CHUNK_INDEX_PATH = os.path.join(CACHE_DIR, "chunk_index.npz")
+CLIP_TEXT_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "clip_text_embeddings.npy")
+# query embeddings, per model, kept in memory up to QUERY_CACHE_SIZE
+QUERY_CACHE_DIR = os.path.join(CACHE_DIR, "query_embeddings")
+QUERY_CACHE_SIZE = 1024
 
 
 def load_movies() -> list[dict]:
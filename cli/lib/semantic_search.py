@@ -1,63 +1,157 @@
-import json
 import os
+import random
 import re
+import tempfile
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
+from .embedding_build import EmbeddingEncoder, fingerprint_texts, update_embeddings
+from .micro_batcher import MicroBatcher
+from .model_registry import get_cross_encoder, get_sentence_transformer, model_stats
+from .quantization import load_or_create_quantized, rescore_shortlist
+from .query_cache import QueryEmbeddingCache
 from .search_utils import (
     CHUNK_EMBEDDINGS_PATH,
+    CHUNK_INDEX_PATH,
     CHUNK_METADATA_PATH,
+    CHUNK_POOLING_MODES,
+    CHUNKERS,
+    CROSS_ENCODER_MODEL,
     DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_OVERLAP_TOKENS,
     DEFAULT_CHUNK_SIZE,
+    DEFAULT_CHUNKER,
+    DEFAULT_EMBED_WORKERS,
+    DEFAULT_IVF_NPROBE,
+    DEFAULT_POOLING_TOP_M,
     DEFAULT_SEARCH_LIMIT,
     DEFAULT_SEMANTIC_CHUNK_SIZE,
     DOCUMENT_PREVIEW_LENGTH,
+    ENCODER_BACKENDS,
+    MICRO_BATCH_SIZE,
+    MICRO_BATCH_WAIT_MS,
     MOVIE_EMBEDDINGS_PATH,
+    ONNX_THREADS,
+    QUANTIZATION_METHODS,
+    QUANTIZED_RESCORE_FACTOR,
     format_search_result,
     load_movies,
 )
+from .vector_index import (
+    IVFIndex,
+    load_embeddings,
+    normalize_embeddings,
+    score_rows,
+    top_k_indices,
+)
+
+# (model, backend, onnx threads) -> batcher; queries from concurrent callers
+# share one forward pass, whichever searcher they come through
+query_batchers = {}
+
+
+def get_query_batcher(
+    model_name: str, backend: str = "torch", onnx_threads: int = ONNX_THREADS
+) -> MicroBatcher:
+    key = (model_name, backend, onnx_threads)
+    batcher = query_batchers.get(key)
+    if batcher is None:
+        batcher = query_batchers.setdefault(
+            key,
+            MicroBatcher(
+                lambda texts: get_sentence_transformer(
+                    model_name, backend, onnx_threads
+                ).encode(texts)
+            ),
+        )
+    return batcher
 
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        quantization=None,
+        cache_dtype=None,
+        workers=DEFAULT_EMBED_WORKERS,
+        backend="torch",
+        onnx_threads=ONNX_THREADS,
+    ):
+        self.model_name = model_name
+        self.encoder = EmbeddingEncoder(model_name, workers)
+        # the backend only runs query encodes; cached document embeddings
+        # always come from the torch model, so they don't depend on it
+        self.backend = backend
+        self.onnx_threads = onnx_threads
+        cache_name = model_name if backend == "torch" else f"{model_name}.{backend}"
+        self.query_cache = QueryEmbeddingCache(cache_name)
+        # unit-length rows memory-mapped from the cache; with quantization
+        # they are only read to re-score the shortlist from the codes
         self.embeddings = None
+        self.quantization = quantization
+        self.quantized_embeddings = None
+        # dtype to store embedding caches in; None keeps what is on disk
+        self.cache_dtype = cache_dtype
         self.documents = None
         self.document_map = {}
 
+    @property
+    def model(self):
+        """The shared model, loaded on first use."""
+        return get_sentence_transformer(self.model_name)
+
+    @property
+    def query_model(self):
+        """The shared model on the selected backend, loaded on first use."""
+        return get_sentence_transformer(
+            self.model_name, self.backend, self.onnx_threads
+        )
+
+    @property
+    def query_batcher(self) -> MicroBatcher:
+        """The batcher shared by every searcher on this model and backend."""
+        return get_query_batcher(self.model_name, self.backend, self.onnx_threads)
+
     def generate_embedding(self, text):
-        if not text or not text.strip():
+        return self.generate_embeddings([text])[0]
+
+    def generate_embeddings(self, texts):
+        if any(not text or not text.strip() for text in texts):
             raise ValueError("cannot generate embedding for empty text")
-        return self.model.encode([text])[0]
+        # the cache is only locked for its lookups and appends, so the misses
+        # of concurrent callers still meet in one batched encode
+        return self.query_cache.embed(texts, self.query_batcher)
 
     def build_embeddings(self, documents):
+        """Embed `documents`, encoding only movies whose text is not cached."""
         self.documents = documents
         self.document_map = {}
         movie_strings = []
         for doc in documents:
             self.document_map[doc["id"]] = doc
             movie_strings.append(f"{doc['title']}: {doc['description']}")
-        self.embeddings = self.model.encode(movie_strings, show_progress_bar=True)
 
-        os.makedirs(os.path.dirname(MOVIE_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(MOVIE_EMBEDDINGS_PATH, self.embeddings)
+        self.embeddings = update_embeddings(
+            MOVIE_EMBEDDINGS_PATH, movie_strings, self.encoder, self.cache_dtype
+        )
+        if self.quantization is not None:
+            self.quantized_embeddings = load_or_create_quantized(
+                MOVIE_EMBEDDINGS_PATH, self.embeddings, self.quantization
+            )
         return self.embeddings
 
     def load_or_create_embeddings(self, documents):
-        self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
-
-        if os.path.exists(MOVIE_EMBEDDINGS_PATH):
-            self.embeddings = np.load(MOVIE_EMBEDDINGS_PATH)
-            if len(self.embeddings) == len(documents):
-                return self.embeddings
-
         return self.build_embeddings(documents)
 
     def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        return self.search_batch([query], limit)[0]
+
+    def search_batch(self, queries, limit=DEFAULT_SEARCH_LIMIT):
+        """Rank movies for every query with one matrix product."""
         if self.embeddings is None or self.embeddings.size == 0:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
@@ -68,26 +162,42 @@ class SemanticSearch:
                 "No documents loaded. Call `load_or_create_embeddings` first."
             )
 
-        query_embedding = self.generate_embedding(query)
-
-        similarities = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            similarity = cosine_similarity(query_embedding, doc_embedding)
-            similarities.append((similarity, self.documents[i]))
-
-        similarities.sort(key=lambda x: x[0], reverse=True)
-
-        results = []
-        for score, doc in similarities[:limit]:
-            results.append(
-                {
-                    "score": score,
-                    "title": doc["title"],
-                    "description": doc["description"],
-                }
-            )
+        query_embeddings = normalize_embeddings(self.generate_embeddings(queries))
+        return self.search_embeddings(query_embeddings, limit)
+
+    def search_embeddings(self, query_embeddings, limit=DEFAULT_SEARCH_LIMIT):
+        """Rank movies for already normalized query embeddings."""
+        if self.quantized_embeddings is None:
+            all_scores = score_rows(self.embeddings, query_embeddings)
+
+        all_results = []
+        for i, query_embedding in enumerate(query_embeddings):
+            if self.quantized_embeddings is None:
+                doc_indices = top_k_indices(all_scores[i], limit)
+                scores = all_scores[i][doc_indices]
+            else:
+                shortlist, shortlist_scores = rescore_shortlist(
+                    self.quantized_embeddings,
+                    self.embeddings,
+                    query_embedding,
+                    limit * QUANTIZED_RESCORE_FACTOR,
+                )
+                order = top_k_indices(shortlist_scores, limit)
+                doc_indices, scores = shortlist[order], shortlist_scores[order]
+
+            results = []
+            for doc_idx, score in zip(doc_indices, scores):
+                doc = self.documents[doc_idx]
+                results.append(
+                    {
+                        "score": score,
+                        "title": doc["title"],
+                        "description": doc["description"],
+                    }
+                )
+            all_results.append(results)
 
-        return results
+        return all_results
 
 
 def cosine_similarity(vec1, vec2):
@@ -105,6 +215,11 @@ def verify_model():
     search_instance = SemanticSearch()
     print(f"Model loaded: {search_instance.model}")
     print(f"Max sequence length: {search_instance.model.max_seq_length}")
+    for stats in model_stats():
+        print(
+            f"{stats['name']}: loaded in {stats['load_seconds']:.2f} s, "
+            f"{stats['resident_bytes'] / 2**20:.1f} MiB resident"
+        )
 
 
 def embed_text(text):
@@ -133,8 +248,10 @@ def embed_query_text(query):
     print(f"Shape: {embedding.shape}")
 
 
-def semantic_search(query, limit=DEFAULT_SEARCH_LIMIT):
-    search_instance = SemanticSearch()
+def semantic_search(
+    query, limit=DEFAULT_SEARCH_LIMIT, quantization=None, backend="torch"
+):
+    search_instance = SemanticSearch(quantization=quantization, backend=backend)
     documents = load_movies()
     search_instance.load_or_create_embeddings(documents)
 
@@ -192,10 +309,7 @@ def semantic_chunk(
     if not text:
         return []
 
-    sentences = re.split(r"(?<=[.!?])\s+", text)
-
-    if len(sentences) == 1 and not text.endswith((".", "!", "?")):
-        sentences = [text]
+    sentences = split_sentences(text)
 
     chunks = []
     i = 0
@@ -218,6 +332,69 @@ def semantic_chunk(
     return chunks
 
 
+def split_sentences(text: str) -> list[str]:
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+
+    if len(sentences) == 1 and not text.endswith((".", "!", "?")):
+        sentences = [text]
+    return sentences
+
+
+def token_chunks(
+    text: str,
+    tokenizer,
+    max_tokens: int,
+    overlap_tokens: int = DEFAULT_CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
+    """Pack whole sentences into chunks of at most `max_tokens` tokens.
+
+    Each chunk after the first starts with the trailing sentences of the one
+    before, up to `overlap_tokens` of them. A sentence longer than
+    `max_tokens` is cut at token boundaries into chunks of its own.
+    """
+    text = text.strip()
+    if not text:
+        return
+
+    chunk, size = [], 0
+    for sentence in split_sentences(text):
+        for piece, count in _fit_sentence(sentence.strip(), tokenizer, max_tokens):
+            if chunk and size + count > max_tokens:
+                yield " ".join(piece for piece, _ in chunk)
+                overlap, overlap_size = [], 0
+                for previous, previous_count in reversed(chunk):
+                    new_size = overlap_size + previous_count
+                    if new_size > overlap_tokens or new_size + count > max_tokens:
+                        break
+                    overlap.insert(0, (previous, previous_count))
+                    overlap_size = new_size
+                chunk, size = overlap, overlap_size
+            chunk.append((piece, count))
+            size += count
+    if chunk:
+        yield " ".join(piece for piece, _ in chunk)
+
+
+def _fit_sentence(
+    sentence: str, tokenizer, max_tokens: int
+) -> Iterator[tuple[str, int]]:
+    encoding = tokenizer(
+        sentence, add_special_tokens=False, return_offsets_mapping=True
+    )
+    offsets = encoding["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        yield sentence, len(offsets)
+        return
+    for start in range(0, len(offsets), max_tokens):
+        window = offsets[start : start + max_tokens]
+        yield sentence[window[0][0] : window[-1][1]], len(window)
+
+
+def token_budget(model) -> int:
+    """Tokens of text the model encodes per input, after special tokens."""
+    return model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+
+
 def semantic_chunk_text(
     text: str,
     max_chunk_size: int = DEFAULT_SEMANTIC_CHUNK_SIZE,
@@ -229,122 +406,715 @@ def semantic_chunk_text(
         print(f"{i + 1}. {chunk}")
 
 
+class ChunkTexts:
+    """The chunk texts of `documents`, chunked afresh on every iteration."""
+
+    def __init__(self, searcher: "ChunkedSemanticSearch", documents: list[dict]):
+        self.searcher = searcher
+        self.documents = documents
+
+    def __iter__(self) -> Iterator[str]:
+        for _, _, chunk in self.searcher.iter_chunks(self.documents):
+            yield chunk
+
+
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        ann: bool = False,
+        nprobe: int = DEFAULT_IVF_NPROBE,
+        quantization: str | None = None,
+        cache_dtype: str | None = None,
+        workers: int = DEFAULT_EMBED_WORKERS,
+        pooling: str = "max",
+        pooling_top_m: int = DEFAULT_POOLING_TOP_M,
+        backend: str = "torch",
+        onnx_threads: int = ONNX_THREADS,
+        chunker: str | None = None,
+    ) -> None:
+        super().__init__(
+            model_name, quantization, cache_dtype, workers, backend, onnx_threads
+        )
+        if pooling not in CHUNK_POOLING_MODES:
+            raise ValueError(f"unknown chunk pooling mode '{pooling}'")
+        if chunker is not None and chunker not in CHUNKERS:
+            raise ValueError(f"unknown chunker '{chunker}'")
+        # None takes the chunker of the cached chunks, so only an explicit
+        # choice of another one rebuilds them
+        self.chunker = chunker
+        self.document_index = {}
         self.chunk_embeddings = None
-        self.chunk_metadata = None
+        self.quantized_chunk_embeddings = None
+        # chunks are stored grouped by movie: chunk i belongs to movie
+        # chunk_movie_idx[i], and movie m owns the chunks in
+        # movie_chunk_offsets[m]:movie_chunk_offsets[m + 1]
+        self.chunk_movie_idx = None
+        self.chunk_idx = None
+        self.movie_chunk_offsets = None
+        self.chunk_segment_starts = None
+        self.pooling = pooling
+        self.pooling_top_m = pooling_top_m
+        self.ann = ann
+        self.nprobe = nprobe
+        self.ann_index = None
 
     def build_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
         self.documents = documents
 
         self.document_map = {}
-        for doc in documents:
+        self.document_index = {}
+        for idx, doc in enumerate(documents):
             self.document_map[doc["id"]] = doc
+            self.document_index[doc["id"]] = idx
+
+        if self.chunker is None:
+            self.chunker = DEFAULT_CHUNKER
+        chunk_movie_idx, chunk_idx = array("i"), array("i")
+
+        def chunk_texts() -> Iterator[str]:
+            for idx, i, chunk in self.iter_chunks(documents):
+                chunk_movie_idx.append(idx)
+                chunk_idx.append(i)
+                yield chunk
+
+        # chunks are fingerprinted as they are made and made again while
+        # encoding, so their texts are never all held at once
+        fingerprints = fingerprint_texts(chunk_texts())
+        self.chunk_embeddings = update_embeddings(
+            CHUNK_EMBEDDINGS_PATH,
+            ChunkTexts(self, documents),
+            self.encoder,
+            self.cache_dtype,
+            fingerprints=fingerprints,
+        )
+        self.chunk_movie_idx = np.array(chunk_movie_idx, dtype=np.int32)
+        self.chunk_idx = np.array(chunk_idx, dtype=np.int32)
+        self.movie_chunk_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.chunk_movie_idx, minlength=len(documents)),
+            out=self.movie_chunk_offsets[1:],
+        )
+        save_chunk_metadata(
+            CHUNK_METADATA_PATH,
+            self.chunk_movie_idx,
+            self.chunk_idx,
+            self.movie_chunk_offsets,
+            self.chunker,
+            chunk_source_fingerprint(documents, self.chunker, self.model_name),
+        )
+        self.__index_chunks()
 
-        all_chunks = []
-        chunk_metadata = []
+        return self.chunk_embeddings
 
+    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
+        self.documents = documents
+        self.document_map = {}
+        self.document_index = {}
+        for idx, doc in enumerate(documents):
+            self.document_map[doc["id"]] = doc
+            self.document_index[doc["id"]] = idx
+
+        if os.path.exists(CHUNK_METADATA_PATH):
+            metadata = load_chunk_metadata(CHUNK_METADATA_PATH)
+            if self.chunker is None:
+                self.chunker = metadata["chunker"]
+            # same descriptions and chunking settings: the cache is current
+            fingerprint = chunk_source_fingerprint(
+                documents, self.chunker, self.model_name
+            )
+            if os.path.exists(CHUNK_EMBEDDINGS_PATH) and (
+                metadata["source_fingerprint"] == fingerprint
+            ):
+                self.chunk_embeddings = load_embeddings(
+                    CHUNK_EMBEDDINGS_PATH, self.cache_dtype
+                )
+                self.chunk_movie_idx = metadata["movie_idx"]
+                self.chunk_idx = metadata["chunk_idx"]
+                self.movie_chunk_offsets = metadata["movie_offsets"]
+                self.__index_chunks()
+                return self.chunk_embeddings
+
+        return self.build_chunk_embeddings(documents)
+
+    def iter_chunks(self, documents: list[dict]) -> Iterator[tuple[int, int, str]]:
+        """(movie index, chunk index, text) for every chunk, movie by movie."""
+        if self.chunker == "tokens":
+            tokenizer = self.model.tokenizer
+            max_tokens = token_budget(self.model)
         for idx, doc in enumerate(documents):
             text = doc.get("description", "")
             if not text.strip():
                 continue
+            if self.chunker == "tokens":
+                chunks = token_chunks(text, tokenizer, max_tokens)
+            else:
+                chunks = semantic_chunk(
+                    text,
+                    max_chunk_size=DEFAULT_SEMANTIC_CHUNK_SIZE,
+                    overlap=DEFAULT_CHUNK_OVERLAP,
+                )
+            for i, chunk in enumerate(chunks):
+                yield idx, i, chunk
 
-            chunks = semantic_chunk(
-                text,
-                max_chunk_size=DEFAULT_SEMANTIC_CHUNK_SIZE,
-                overlap=DEFAULT_CHUNK_OVERLAP,
+    def __index_chunks(self) -> None:
+        if self.quantization is not None:
+            self.quantized_chunk_embeddings = load_or_create_quantized(
+                CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings, self.quantization
             )
+        # movies without chunks have empty segments, which reduceat can't take
+        chunk_counts = np.diff(self.movie_chunk_offsets)
+        self.chunk_segment_starts = self.movie_chunk_offsets[:-1][chunk_counts > 0]
+        # an index older than the embeddings is rebuilt here, and a search
+        # without --ann never needs one
+        if self.ann:
+            self.load_or_create_ann_index()
+
+    def build_ann_index(self) -> IVFIndex:
+        vectors = np.asarray(self.chunk_embeddings, dtype=np.float32)
+        self.ann_index = IVFIndex.build(vectors)
+        self.ann_index.save(CHUNK_INDEX_PATH)
+        return self.ann_index
+
+    def load_or_create_ann_index(self) -> IVFIndex:
+        fresh = os.path.exists(CHUNK_INDEX_PATH) and (
+            os.path.getmtime(CHUNK_INDEX_PATH)
+            >= os.path.getmtime(CHUNK_EMBEDDINGS_PATH)
+        )
+        if fresh:
+            self.ann_index = IVFIndex.load(CHUNK_INDEX_PATH)
+            if len(self.ann_index) == len(self.chunk_embeddings):
+                return self.ann_index
+
+        return self.build_ann_index()
 
-            for i, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                chunk_metadata.append(
-                    {"movie_idx": idx, "chunk_idx": i, "total_chunks": len(chunks)}
-                )
-
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_metadata
+    def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
+        return self.search_chunks_batch([query], limit)[0]
 
-        os.makedirs(os.path.dirname(CHUNK_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings)
-        with open(CHUNK_METADATA_PATH, "w") as f:
-            json.dump(
-                {"chunks": chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2
+    def search_chunks_batch(
+        self, queries: list[str], limit: int = 10
+    ) -> list[list[dict]]:
+        """Rank movies by their best chunk for every query at once."""
+        if self.chunk_embeddings is None or self.chunk_movie_idx is None:
+            raise ValueError(
+                "No chunk embeddings loaded. Call load_or_create_chunk_embeddings first."
             )
 
-        return self.chunk_embeddings
+        query_embeddings = normalize_embeddings(self.generate_embeddings(queries))
+        return self.search_chunk_embeddings(query_embeddings, limit)
+
+    def search_chunk_embeddings(
+        self, query_embeddings: np.ndarray, limit: int = 10
+    ) -> list[list[dict]]:
+        """Rank movies for already normalized query embeddings.
+
+        With `ann` enabled only the chunks in the IVF lists nearest to each
+        query are scored. With quantization, the quantized scan keeps a
+        shortlist of QUANTIZED_RESCORE_FACTOR * limit chunks, which are
+        re-scored exactly. Otherwise every chunk is scored in one matrix
+        product. Chunk scores are then pooled into movie scores, reducing
+        only the movies that have scored chunks.
+        """
+        use_ann = self.ann and self.ann_index is not None
+        quantized = self.quantized_chunk_embeddings
+        if not use_ann and quantized is None:
+            all_chunk_scores = score_rows(self.chunk_embeddings, query_embeddings)
+
+        all_results = []
+        for i, query_embedding in enumerate(query_embeddings):
+            chunk_ids = None
+            if use_ann:
+                chunk_ids = self.ann_index.candidates(query_embedding, self.nprobe)
+            if quantized is not None:
+                chunk_ids, chunk_scores = rescore_shortlist(
+                    quantized,
+                    self.chunk_embeddings,
+                    query_embedding,
+                    limit * QUANTIZED_RESCORE_FACTOR,
+                    chunk_ids,
+                )
+            elif chunk_ids is not None:
+                chunk_scores = score_rows(
+                    self.chunk_embeddings[chunk_ids], query_embedding
+                )
+            else:
+                chunk_scores = all_chunk_scores[i]
+            # chunk ids come back ascending, so their movies stay grouped
+            if chunk_ids is None:
+                movie_ids, movie_scores = pool_chunk_scores(
+                    chunk_scores,
+                    self.chunk_movie_idx,
+                    self.pooling,
+                    self.pooling_top_m,
+                    self.chunk_segment_starts,
+                )
+            else:
+                movie_ids, movie_scores = pool_chunk_scores(
+                    chunk_scores,
+                    self.chunk_movie_idx[chunk_ids],
+                    self.pooling,
+                    self.pooling_top_m,
+                )
 
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
+            all_results.append(self.__rank_movies(movie_ids, movie_scores, limit))
 
-        if os.path.exists(CHUNK_EMBEDDINGS_PATH) and os.path.exists(
-            CHUNK_METADATA_PATH
-        ):
-            self.chunk_embeddings = np.load(CHUNK_EMBEDDINGS_PATH)
-            with open(CHUNK_METADATA_PATH, "r") as f:
-                data = json.load(f)
-                self.chunk_metadata = data["chunks"]
-            return self.chunk_embeddings
+        return all_results
 
-        return self.build_chunk_embeddings(documents)
+    def search_candidate_chunks(
+        self, query: str, doc_ids: Iterable[int], limit: int = 10
+    ) -> list[dict]:
+        """Rank only the given movies, scoring just their own chunks.
 
-    def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
-        if self.chunk_embeddings is None or self.chunk_metadata is None:
+        Each movie's chunks are looked up through movie_chunk_offsets, so the
+        work grows with the candidates' chunks, not with the whole corpus.
+        Unknown doc ids and movies without chunks are left out.
+        """
+        if self.chunk_embeddings is None or self.movie_chunk_offsets is None:
             raise ValueError(
                 "No chunk embeddings loaded. Call load_or_create_chunk_embeddings first."
             )
 
-        query_embedding = self.generate_embedding(query)
-
-        chunk_scores = []
-        for i, chunk_embedding in enumerate(self.chunk_embeddings):
-            similarity = cosine_similarity(query_embedding, chunk_embedding)
-            chunk_scores.append(
-                {
-                    "chunk_idx": i,
-                    "movie_idx": self.chunk_metadata[i]["movie_idx"],
-                    "score": similarity,
-                }
-            )
-
-        movie_scores = {}
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            if (
-                movie_idx not in movie_scores
-                or chunk_score["score"] > movie_scores[movie_idx]
-            ):
-                movie_scores[movie_idx] = chunk_score["score"]
-
-        sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-
+        movies = {self.document_index.get(doc_id) for doc_id in doc_ids}
+        movies.discard(None)
+        movies = np.array(sorted(movies), dtype=np.int64)
+        starts = self.movie_chunk_offsets[movies]
+        counts = self.movie_chunk_offsets[movies + 1] - starts
+        # the candidates' chunk ranges, back to back
+        segment_starts = np.cumsum(counts) - counts
+        chunk_ids = np.arange(counts.sum()) + np.repeat(starts - segment_starts, counts)
+
+        query_embedding = normalize_embeddings(self.generate_embeddings([query]))[0]
+        chunk_scores = score_rows(self.chunk_embeddings[chunk_ids], query_embedding)
+        movie_ids, movie_scores = pool_chunk_scores(
+            chunk_scores,
+            self.chunk_movie_idx[chunk_ids],
+            self.pooling,
+            self.pooling_top_m,
+            segment_starts[counts > 0],
+        )
+        return self.__rank_movies(movie_ids, movie_scores, limit)
+
+    def __rank_movies(
+        self, movie_ids: np.ndarray, movie_scores: np.ndarray, limit: int
+    ) -> list[dict]:
         results = []
-        for movie_idx, score in sorted_movies[:limit]:
-            doc = self.documents[movie_idx]
+        for i in top_k_indices(movie_scores, limit):
+            doc = self.documents[movie_ids[i]]
             results.append(
                 format_search_result(
                     doc_id=doc["id"],
                     title=doc["title"],
                     document=doc["description"][:DOCUMENT_PREVIEW_LENGTH],
-                    score=score,
+                    score=movie_scores[i],
                 )
             )
-
         return results
 
 
-def embed_chunks_command() -> np.ndarray:
+def pool_chunk_scores(
+    chunk_scores: np.ndarray,
+    chunk_movie_idx: np.ndarray,
+    pooling: str = "max",
+    top_m: int = DEFAULT_POOLING_TOP_M,
+    segment_starts: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """One score per movie from the scores of its chunks.
+
+    Chunks must be grouped by movie, each movie's chunks contiguous;
+    `segment_starts` are the group starts, found from `chunk_movie_idx` if
+    not given. Returns the movies that have chunks, in chunk order, and their
+    pooled scores.
+    """
+    if len(chunk_scores) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    if segment_starts is None:
+        boundaries = np.flatnonzero(chunk_movie_idx[1:] != chunk_movie_idx[:-1])
+        segment_starts = np.concatenate([[0], boundaries + 1])
+    movie_ids = chunk_movie_idx[segment_starts]
+    if pooling == "max":
+        return movie_ids, np.maximum.reduceat(chunk_scores, segment_starts)
+
+    counts = np.diff(np.append(segment_starts, len(chunk_scores)))
+    if pooling == "mean":
+        sums = np.add.reduceat(chunk_scores, segment_starts)
+        return movie_ids, (sums / counts).astype(np.float32)
+    if pooling == "top-m":
+        # sort each segment best first, in place, and zero all but its first m
+        segments = np.repeat(np.arange(len(segment_starts)), counts)
+        ranked = chunk_scores[np.lexsort((-chunk_scores, segments))]
+        rank = np.arange(len(ranked)) - segment_starts[segments]
+        ranked[rank >= top_m] = 0
+        return movie_ids, np.add.reduceat(ranked, segment_starts)
+    raise ValueError(f"unknown chunk pooling mode '{pooling}'")
+
+
+def save_chunk_metadata(
+    path: str,
+    movie_idx: np.ndarray,
+    chunk_idx: np.ndarray,
+    movie_offsets: np.ndarray,
+    chunker: str,
+    source_fingerprint: str,
+) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            movie_idx=movie_idx,
+            chunk_idx=chunk_idx,
+            movie_offsets=movie_offsets,
+            chunker=np.array(chunker),
+            source_fingerprint=np.array(source_fingerprint),
+        )
+    os.replace(tmp_path, path)
+
+
+def load_chunk_metadata(path: str) -> dict:
+    with np.load(path) as data:
+        metadata = {name: data[name] for name in data.files}
+    metadata["source_fingerprint"] = str(metadata["source_fingerprint"])
+    # metadata saved before the chunker was recorded came from the default
+    metadata["chunker"] = str(metadata.get("chunker", DEFAULT_CHUNKER))
+    return metadata
+
+
+def chunk_source_fingerprint(
+    documents: list[dict], chunker: str = "sentences", model_name: str = ""
+) -> str:
+    """Digest of everything chunking reads, to tell when chunks are stale.
+
+    Token chunks depend on the model's tokenizer and sequence length, so
+    they are tied to its name.
+    """
+    if chunker == "tokens":
+        parts = [f"tokens:{model_name}:{DEFAULT_CHUNK_OVERLAP_TOKENS}"]
+    else:
+        parts = [f"{DEFAULT_SEMANTIC_CHUNK_SIZE}:{DEFAULT_CHUNK_OVERLAP}"]
+    parts.extend(doc.get("description", "") for doc in documents)
+    return fingerprint_texts(["\0".join(parts)])[0].tobytes().hex()
+
+
+def embed_chunks_command(
+    cache_dtype: str | None = None,
+    workers: int = DEFAULT_EMBED_WORKERS,
+    chunker: str | None = None,
+    quantization: str | None = None,
+) -> np.ndarray:
+    """Build or update the chunk embeddings and their IVF index.
+
+    With `quantization`, the codes for that method are fitted and cached
+    too, so quantized searches don't fit them on their first query.
+    """
     movies = load_movies()
-    searcher = ChunkedSemanticSearch()
-    return searcher.load_or_create_chunk_embeddings(movies)
+    searcher = ChunkedSemanticSearch(
+        quantization=quantization,
+        cache_dtype=cache_dtype,
+        workers=workers,
+        chunker=chunker,
+    )
+    embeddings = searcher.load_or_create_chunk_embeddings(movies)
+    searcher.load_or_create_ann_index()
+    return embeddings
+
+
+def search_chunked_command(
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    ann: bool = False,
+    nprobe: int = DEFAULT_IVF_NPROBE,
+    quantization: str | None = None,
+    pooling: str = "max",
+    pooling_top_m: int = DEFAULT_POOLING_TOP_M,
+    backend: str = "torch",
+    chunker: str | None = None,
+) -> dict:
+    movies = load_movies()
+    searcher = ChunkedSemanticSearch(
+        ann=ann,
+        nprobe=nprobe,
+        quantization=quantization,
+        pooling=pooling,
+        pooling_top_m=pooling_top_m,
+        backend=backend,
+        chunker=chunker,
+    )
+    searcher.load_or_create_chunk_embeddings(movies)
+    results = searcher.search_chunks(query, limit)
+    return {"query": query, "results": results}
+
 
+def chunk_report_command() -> dict:
+    """Chunks and token use of each chunker over the movie descriptions.
 
-def search_chunked_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> dict:
+    Tokens past the model's budget are truncated: tokenized, then thrown
+    away. Fill is the share of each chunk's budget that holds text.
+    """
+    movies = load_movies()
+    searcher = SemanticSearch()
+    tokenizer = searcher.model.tokenizer
+    max_tokens = token_budget(searcher.model)
+    chunkers = {
+        "words": lambda text: fixed_size_chunking(text),
+        "sentences": lambda text: semantic_chunk(text),
+        "tokens": lambda text: token_chunks(text, tokenizer, max_tokens),
+    }
+
+    runs = []
+    for name, chunker in chunkers.items():
+        chunk_count = encoded = truncated = 0
+        for movie in movies:
+            text = movie.get("description", "")
+            if not text.strip():
+                continue
+            for chunk in chunker(text):
+                tokens = len(tokenizer(chunk, add_special_tokens=False)["input_ids"])
+                chunk_count += 1
+                encoded += min(tokens, max_tokens)
+                truncated += max(0, tokens - max_tokens)
+        runs.append(
+            {
+                "chunker": name,
+                "chunks": chunk_count,
+                "encoded_tokens": encoded,
+                "truncated_tokens": truncated,
+                "fill": encoded / (chunk_count * max_tokens) if chunk_count else 0.0,
+            }
+        )
+    return {"max_tokens": max_tokens, "runs": runs}
+
+
+def ann_benchmark_command(
+    nprobes: list[int], limit: int = DEFAULT_SEARCH_LIMIT, query_count: int = 100
+) -> dict:
+    """Recall@limit and latency of IVF search against the exact chunk scan."""
+    movies = load_movies()
+    searcher = ChunkedSemanticSearch(ann=True)
+    searcher.load_or_create_chunk_embeddings(movies)
+    query_embeddings = _sample_query_embeddings(searcher, movies, query_count)
+
+    searcher.ann = False
+    exact, exact_ms = _time_chunk_search(searcher, query_embeddings, limit)
+    searcher.ann = True
+    runs = []
+    for nprobe in nprobes:
+        searcher.nprobe = nprobe
+        found, ms = _time_chunk_search(searcher, query_embeddings, limit)
+        recall = _mean_recall(found, exact)
+        runs.append({"nprobe": nprobe, "recall": recall, "ms_per_query": ms})
+
+    return {
+        "chunks": len(searcher.chunk_embeddings),
+        "lists": len(searcher.ann_index.centroids),
+        "queries": len(query_embeddings),
+        "limit": limit,
+        "exact_ms_per_query": exact_ms,
+        "runs": runs,
+    }
+
+
+def quantization_benchmark_command(
+    limit: int = DEFAULT_SEARCH_LIMIT, query_count: int = 100
+) -> dict:
+    """Memory, recall@limit and latency of quantized chunk search vs exact."""
     movies = load_movies()
     searcher = ChunkedSemanticSearch()
     searcher.load_or_create_chunk_embeddings(movies)
-    results = searcher.search_chunks(query, limit)
-    return {"query": query, "results": results}
+    query_embeddings = _sample_query_embeddings(searcher, movies, query_count)
+    exact, exact_ms = _time_chunk_search(searcher, query_embeddings, limit)
+
+    runs = []
+    for method in QUANTIZATION_METHODS:
+        quantized_searcher = ChunkedSemanticSearch(quantization=method)
+        quantized_searcher.load_or_create_chunk_embeddings(movies)
+        found, ms = _time_chunk_search(quantized_searcher, query_embeddings, limit)
+        runs.append(
+            {
+                "method": method,
+                "bytes": quantized_searcher.quantized_chunk_embeddings.nbytes,
+                "recall": _mean_recall(found, exact),
+                "ms_per_query": ms,
+            }
+        )
+
+    return {
+        "chunks": len(searcher.chunk_embeddings),
+        "queries": len(query_embeddings),
+        "limit": limit,
+        "exact_bytes": searcher.chunk_embeddings.nbytes,
+        "exact_ms_per_query": exact_ms,
+        "runs": runs,
+    }
+
+
+def micro_batch_benchmark_command(
+    threads: int = 8,
+    query_count: int = 256,
+    max_batch_size: int = MICRO_BATCH_SIZE,
+    max_wait_ms: float = MICRO_BATCH_WAIT_MS,
+) -> dict:
+    """Query encoding throughput under concurrent load, with and without
+    micro-batching, with the query cache bypassed.
+
+    Then concurrent callers go through generate_embedding, cache included,
+    twice: into an empty cache and out of it reopened. Embeddings that
+    differ from an encode of their own query are counted as mismatches.
+    """
+    movies = load_movies()
+    searcher = SemanticSearch()
+    sample = random.Random(0).sample(movies, min(query_count, len(movies)))
+    queries = [movie["title"] for movie in sample]
+    batcher = MicroBatcher(searcher.model.encode, max_batch_size, max_wait_ms)
+
+    direct = _encode_throughput(
+        lambda query: searcher.model.encode([query]), queries, threads
+    )
+    batched = _encode_throughput(lambda query: batcher([query]), queries, threads)
+
+    expected = searcher.model.encode(queries)
+    mismatches = 0
+    with (
+        tempfile.TemporaryDirectory() as cache_dir,
+        ThreadPoolExecutor(max_workers=threads) as pool,
+    ):
+        for _ in range(2):
+            searcher.query_cache = QueryEmbeddingCache(searcher.model_name, cache_dir)
+            embeddings = np.array(list(pool.map(searcher.generate_embedding, queries)))
+            matches = np.isclose(embeddings, expected, atol=1e-4).all(axis=1)
+            mismatches += int((~matches).sum())
+    return {
+        "threads": threads,
+        "queries": len(queries),
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "direct_qps": direct,
+        "batched_qps": batched,
+        "mean_batch_size": batcher.items / batcher.batches,
+        "cached_embeddings": 2 * len(queries),
+        "cache_mismatches": mismatches,
+    }
+
+
+def backend_benchmark_command(
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    query_count: int = 100,
+    onnx_threads: int = ONNX_THREADS,
+) -> dict:
+    """Query latency and accuracy of each inference backend against torch.
+
+    Accuracy is the cosine between each query's embeddings, recall@limit of
+    movie search, and for the cross-encoder the rank correlation of its
+    scores over the torch results. Latency is per query, one at a time, as
+    a search sees it; the caches are bypassed.
+    """
+    movies = load_movies()
+    searcher = SemanticSearch()
+    searcher.load_or_create_embeddings(movies)
+    sample = random.Random(0).sample(movies, min(query_count, len(movies)))
+    queries = [movie["title"] for movie in sample]
+
+    runs = []
+    for backend in ENCODER_BACKENDS:
+        model = get_sentence_transformer(searcher.model_name, backend, onnx_threads)
+        embeddings, encode_ms = _time_calls(
+            model.encode, [[query] for query in queries]
+        )
+        embeddings = normalize_embeddings(np.concatenate(embeddings))
+        results = searcher.search_embeddings(embeddings, limit)
+        cross_encoder = get_cross_encoder(CROSS_ENCODER_MODEL, backend, onnx_threads)
+        pair_lists = [
+            [
+                [query, f"{result['title']} - {result['description']}"]
+                for result in query_results
+            ]
+            for query, query_results in zip(queries, results)
+        ]
+        scores, rerank_ms = _time_calls(cross_encoder.predict, pair_lists)
+        runs.append(
+            {
+                "backend": backend,
+                "embeddings": embeddings,
+                "found": [{result["title"] for result in r} for r in results],
+                "scores": scores,
+                "encode_ms": encode_ms,
+                "rerank_ms": rerank_ms,
+            }
+        )
+
+    reference = runs[0]
+    for run in runs:
+        cosines = np.sum(run["embeddings"] * reference["embeddings"], axis=1)
+        run["min_cosine"] = float(cosines.min())
+        run["recall"] = _mean_recall(run["found"], reference["found"])
+        correlations = [
+            _rank_correlation(scores, reference_scores)
+            for scores, reference_scores in zip(run["scores"], reference["scores"])
+        ]
+        run["rank_correlation"] = float(np.mean(correlations))
+    for run in runs:
+        del run["embeddings"], run["found"], run["scores"]
+
+    return {
+        "queries": len(queries),
+        "limit": limit,
+        "runs": runs,
+        "models": model_stats(),
+    }
+
+
+def _time_calls(fn, inputs: list) -> tuple[list, float]:
+    """Outputs of `fn` for each input, and ms per call after a warm-up call."""
+    fn(inputs[0])
+    start = time.perf_counter()
+    outputs = [fn(value) for value in inputs]
+    return outputs, (time.perf_counter() - start) * 1000 / len(inputs)
+
+
+def _rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """Spearman correlation, ignoring ties."""
+    if len(a) < 2:
+        return 1.0
+    rank_a = np.argsort(np.argsort(a)).astype(np.float64)
+    rank_b = np.argsort(np.argsort(b)).astype(np.float64)
+    if rank_a.std() == 0 or rank_b.std() == 0:
+        return 1.0
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def _encode_throughput(encode, queries: list[str], threads: int) -> float:
+    """Queries per second with `threads` callers each encoding one at a time."""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(encode, queries))
+        elapsed = time.perf_counter() - start
+    return len(queries) / elapsed
+
+
+def _sample_query_embeddings(
+    searcher: SemanticSearch, movies: list[dict], count: int
+) -> np.ndarray:
+    # titles of a fixed sample of movies stand in for a query log
+    sample = random.Random(0).sample(movies, min(count, len(movies)))
+    return normalize_embeddings(
+        searcher.generate_embeddings([movie["title"] for movie in sample])
+    )
+
+
+def _time_chunk_search(
+    searcher: ChunkedSemanticSearch, query_embeddings: np.ndarray, limit: int
+) -> tuple[list[set], float]:
+    """Movie ids found per query, and ms per query; query encoding is not timed."""
+    start = time.perf_counter()
+    results = [
+        searcher.search_chunk_embeddings(query_embedding[np.newaxis], limit)[0]
+        for query_embedding in query_embeddings
+    ]
+    elapsed = time.perf_counter() - start
+    found = [{result["id"] for result in query_results} for query_results in results]
+    return found, elapsed * 1000 / len(query_embeddings)
+
+
+def _mean_recall(found: list[set], expected: list[set]) -> float:
+    return float(
+        np.mean([len(f & e) / len(e) if e else 1.0 for f, e in zip(found, expected)])
+    )
@@ -0,0 +1,173 @@
+import os
+
+import numpy as np
+
+# rows scored per matrix product while assigning vectors to lists, and rows
+# converted to float32 at a time when scoring a float16 matrix
+ROW_BATCH_SIZE = 16384
+# rows checked for unit length when opening an embeddings cache
+NORM_CHECK_ROWS = 64
+# k-means trains on at most this many vectors per list
+TRAINING_SAMPLES_PER_LIST = 256
+
+
+class IVFIndex:
+    """Inverted-file index over unit-length vectors for approximate search.
+
+    Spherical k-means splits the vectors into lists around centroids; a query
+    only scores the vectors in the `nprobe` lists whose centroids are most
+    similar to it.
+    """
+
+    def __init__(
+        self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray
+    ) -> None:
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+
+    def __len__(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        list_count: int | None = None,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        if list_count is None:
+            list_count = max(1, round(np.sqrt(len(vectors))))
+        list_count = min(list_count, len(vectors))
+        rng = np.random.default_rng(seed)
+
+        sample = vectors
+        if len(vectors) > list_count * TRAINING_SAMPLES_PER_LIST:
+            rows = rng.choice(
+                len(vectors), list_count * TRAINING_SAMPLES_PER_LIST, replace=False
+            )
+            sample = vectors[np.sort(rows)]
+
+        centroids = sample[rng.choice(len(sample), list_count, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # an empty list keeps its old centroid
+            np.divide(sums, norms, out=centroids, where=norms > 0)
+
+        assignments = _assign(vectors, centroids)
+        list_ids = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(list_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=list_count), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_ids)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_ids=self.list_ids,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"])
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Ids of the vectors in the `nprobe` lists closest to `query`, sorted."""
+        nprobe = min(nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probed = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        ids = np.concatenate(
+            [
+                self.list_ids[self.list_offsets[i] : self.list_offsets[i + 1]]
+                for i in probed
+            ]
+        )
+        return np.sort(ids)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ROW_BATCH_SIZE):
+        batch = vectors[start : start + ROW_BATCH_SIZE]
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """Contiguous float32 copy with unit-length rows, so dot products are cosines.
+
+    All-zero rows stay zero and score 0.0 against everything.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the `limit` highest scores, best first; ties keep index order."""
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if limit < len(scores):
+        top = np.argpartition(scores, -limit)[-limit:]
+        candidates = np.flatnonzero(scores >= scores[top].min())
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))[:limit]
+    return candidates[order]
+
+
+def score_rows(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """`queries @ matrix.T` in float32 for a float32 or float16 `matrix`.
+
+    A float16 matrix is converted a block of rows at a time, never whole.
+    """
+    if matrix.dtype == np.float32:
+        return queries @ matrix.T
+    scores = np.empty((*queries.shape[:-1], len(matrix)), dtype=np.float32)
+    for start in range(0, len(matrix), ROW_BATCH_SIZE):
+        block = np.asarray(matrix[start : start + ROW_BATCH_SIZE], np.float32)
+        scores[..., start : start + len(block)] = queries @ block.T
+    return scores
+
+
+def save_embeddings(path: str, embeddings: np.ndarray, dtype: str) -> None:
+    """Write `embeddings` normalized, as `dtype`, for load_embeddings to map.
+
+    The file is written next to `path` and moved into place, so processes
+    that still map the old file keep a consistent view.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, normalize_embeddings(embeddings).astype(dtype))
+    os.replace(tmp_path, path)
+
+
+def load_embeddings(path: str, dtype: str | None = None) -> np.ndarray:
+    """Memory-map an embeddings cache read-only.
+
+    Every process mapping the file shares one page-cache copy. A cache in a
+    dtype other than `dtype`, or written before rows were stored normalized,
+    is rewritten first.
+    """
+    embeddings = np.load(path, mmap_mode="r")
+    wrong_dtype = dtype is not None and embeddings.dtype != dtype
+    if wrong_dtype or not _has_unit_rows(embeddings):
+        save_embeddings(path, embeddings, dtype or embeddings.dtype)
+        embeddings = np.load(path, mmap_mode="r")
+    return embeddings
+
+
+def _has_unit_rows(embeddings: np.ndarray) -> bool:
+    rows = np.linspace(0, len(embeddings) - 1, min(len(embeddings), NORM_CHECK_ROWS))
+    sample = np.asarray(embeddings[rows.astype(np.int64)], dtype=np.float32)
+    norms = np.linalg.norm(sample, axis=1)
+    return bool(np.all((np.abs(norms - 1) < 1e-2) | (norms == 0)))
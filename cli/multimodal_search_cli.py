@@ -3,6 +3,7 @@
 import argparse
 
 from lib.multimodal_search import verify_image_embedding, image_search_command
+from lib.search_utils import QUANTIZATION_METHODS
 
 
 def main() -> None:
@@ -25,6 +26,12 @@ def main() -> None:
     image_search_cmd.add_argument(
         "img_path", type=str, help="The path to the image to be used for searching"
     )
+    image_search_cmd.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_METHODS,
+        help="Scan quantized text embeddings, then re-score a shortlist exactly",
+    )
 
     args = parser.parse_args()
 
@@ -32,7 +39,7 @@ def main() -> None:
         case "verify_image_embedding":
             verify_image_embedding(args.img_path)
         case "image_search":
-            results = image_search_command(args.img_path)
+            results = image_search_command(args.img_path, args.quantization)
             for i, result in enumerate(results):
                 print(
                     f"{i + 1}. {result["title"]} (similarity: {result["similarity_score"]})"
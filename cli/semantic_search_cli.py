@@ -2,11 +2,29 @@
 
 import argparse
 
+from lib.search_utils import (
+    CHUNK_POOLING_MODES,
+    CHUNKERS,
+    DEFAULT_CHUNKER,
+    DEFAULT_EMBED_WORKERS,
+    DEFAULT_IVF_NPROBE,
+    DEFAULT_POOLING_TOP_M,
+    ENCODER_BACKENDS,
+    MICRO_BATCH_SIZE,
+    MICRO_BATCH_WAIT_MS,
+    ONNX_THREADS,
+    QUANTIZATION_METHODS,
+)
 from lib.semantic_search import (
+    ann_benchmark_command,
+    backend_benchmark_command,
+    chunk_report_command,
     chunk_text,
     embed_chunks_command,
     embed_query_text,
     embed_text,
+    micro_batch_benchmark_command,
+    quantization_benchmark_command,
     search_chunked_command,
     semantic_chunk_text,
     semantic_search,
@@ -42,6 +60,19 @@ def main() -> None:
     search_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return"
     )
+    search_parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_METHODS,
+        help="Scan quantized embeddings, then re-score a shortlist exactly",
+    )
+    search_parser.add_argument(
+        "--backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default="torch",
+        help="Inference backend for encoding the query",
+    )
 
     chunk_parser = subparsers.add_parser(
         "chunk", help="Split text into fixed-size chunks with optional overlap"
@@ -74,9 +105,34 @@ def main() -> None:
         help="Number of sentences to overlap between chunks",
     )
 
-    subparsers.add_parser(
+    embed_chunks_parser = subparsers.add_parser(
         "embed_chunks", help="Generate embeddings for chunked documents"
     )
+    embed_chunks_parser.add_argument(
+        "--cache-dtype",
+        type=str,
+        choices=["float32", "float16"],
+        help="Store the embeddings cache in this dtype, converting an existing one",
+    )
+    embed_chunks_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_EMBED_WORKERS,
+        help="Encoder processes, each loading its own copy of the model",
+    )
+    embed_chunks_parser.add_argument(
+        "--chunker",
+        type=str,
+        choices=CHUNKERS,
+        help="Split descriptions by token budget or into groups of sentences "
+        f"(default: the cached chunks' chunker, else {DEFAULT_CHUNKER})",
+    )
+    embed_chunks_parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_METHODS,
+        help="Also fit and cache quantized codes for search_chunked",
+    )
 
     search_chunked_parser = subparsers.add_parser(
         "search_chunked", help="Search using chunked embeddings"
@@ -85,6 +141,124 @@ def main() -> None:
     search_chunked_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return"
     )
+    search_chunked_parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Only score chunks in the nearest lists of the IVF index",
+    )
+    search_chunked_parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=DEFAULT_IVF_NPROBE,
+        help="Number of IVF lists to scan with --ann",
+    )
+    search_chunked_parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=QUANTIZATION_METHODS,
+        help="Scan quantized embeddings, then re-score a shortlist exactly",
+    )
+    search_chunked_parser.add_argument(
+        "--pooling",
+        type=str,
+        choices=CHUNK_POOLING_MODES,
+        default="max",
+        help="How a movie's chunk scores combine into its score",
+    )
+    search_chunked_parser.add_argument(
+        "--top-m",
+        type=int,
+        default=DEFAULT_POOLING_TOP_M,
+        help="Number of best chunks summed with --pooling top-m",
+    )
+    search_chunked_parser.add_argument(
+        "--backend",
+        type=str,
+        choices=ENCODER_BACKENDS,
+        default="torch",
+        help="Inference backend for encoding the query",
+    )
+    search_chunked_parser.add_argument(
+        "--chunker",
+        type=str,
+        choices=CHUNKERS,
+        help="Chunker to search chunks of, rebuilding them if the cached ones "
+        "came from another (default: the cached chunks' chunker)",
+    )
+
+    subparsers.add_parser(
+        "chunk_report",
+        help="Compare chunk counts and wasted tokens across chunkers",
+    )
+
+    ann_benchmark_parser = subparsers.add_parser(
+        "ann_benchmark",
+        help="Compare IVF recall and latency against the exact chunk scan",
+    )
+    ann_benchmark_parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="IVF list counts to scan",
+    )
+    ann_benchmark_parser.add_argument(
+        "--limit", type=int, default=10, help="Number of results to compare"
+    )
+    ann_benchmark_parser.add_argument(
+        "--queries", type=int, default=100, help="Number of sample queries"
+    )
+
+    quantization_benchmark_parser = subparsers.add_parser(
+        "quantization_benchmark",
+        help="Compare quantized chunk search memory and recall against exact",
+    )
+    quantization_benchmark_parser.add_argument(
+        "--limit", type=int, default=10, help="Number of results to compare"
+    )
+    quantization_benchmark_parser.add_argument(
+        "--queries", type=int, default=100, help="Number of sample queries"
+    )
+
+    batch_benchmark_parser = subparsers.add_parser(
+        "batch_benchmark",
+        help="Compare query encoding throughput with and without micro-batching",
+    )
+    batch_benchmark_parser.add_argument(
+        "--threads", type=int, default=8, help="Number of concurrent callers"
+    )
+    batch_benchmark_parser.add_argument(
+        "--queries", type=int, default=256, help="Number of sample queries"
+    )
+    batch_benchmark_parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=MICRO_BATCH_SIZE,
+        help="Most queries encoded in one forward pass",
+    )
+    batch_benchmark_parser.add_argument(
+        "--wait-ms",
+        type=float,
+        default=MICRO_BATCH_WAIT_MS,
+        help="Longest a query waits for its batch to fill",
+    )
+
+    backend_benchmark_parser = subparsers.add_parser(
+        "backend_benchmark",
+        help="Compare ONNX Runtime backends against torch for latency and accuracy",
+    )
+    backend_benchmark_parser.add_argument(
+        "--limit", type=int, default=10, help="Number of results to compare"
+    )
+    backend_benchmark_parser.add_argument(
+        "--queries", type=int, default=100, help="Number of sample queries"
+    )
+    backend_benchmark_parser.add_argument(
+        "--onnx-threads",
+        type=int,
+        default=ONNX_THREADS,
+        help="ONNX Runtime intra-op threads; 0 lets it decide",
+    )
 
     args = parser.parse_args()
 
@@ -98,21 +272,109 @@ def main() -> None:
         case "embedquery":
             embed_query_text(args.query)
         case "search":
-            semantic_search(args.query, args.limit)
+            semantic_search(args.query, args.limit, args.quantization, args.backend)
         case "chunk":
             chunk_text(args.text, args.chunk_size, args.overlap)
         case "semantic_chunk":
             semantic_chunk_text(args.text, args.max_chunk_size, args.overlap)
         case "embed_chunks":
-            embeddings = embed_chunks_command()
+            embeddings = embed_chunks_command(
+                args.cache_dtype, args.workers, args.chunker, args.quantization
+            )
             print(f"Generated {len(embeddings)} chunked embeddings")
+            if args.quantization:
+                print(f"Cached {args.quantization} codes for them")
         case "search_chunked":
-            result = search_chunked_command(args.query, args.limit)
+            result = search_chunked_command(
+                args.query,
+                args.limit,
+                args.ann,
+                args.nprobe,
+                args.quantization,
+                args.pooling,
+                args.top_m,
+                args.backend,
+                args.chunker,
+            )
             print(f"Query: {result['query']}")
             print("Results:")
             for i, res in enumerate(result["results"], 1):
                 print(f"\n{i}. {res['title']} (score: {res['score']:.4f})")
                 print(f"   {res['document']}...")
+        case "chunk_report":
+            report = chunk_report_command()
+            print(f"{report['max_tokens']} tokens per chunk before truncation")
+            for run in report["runs"]:
+                print(
+                    f"{run['chunker']}: {run['chunks']} chunks, "
+                    f"{run['encoded_tokens']} tokens encoded, "
+                    f"{run['truncated_tokens']} truncated, "
+                    f"{run['fill']:.0%} of each chunk's budget used"
+                )
+        case "ann_benchmark":
+            report = ann_benchmark_command(args.nprobe, args.limit, args.queries)
+            print(
+                f"{report['chunks']} chunks in {report['lists']} lists, "
+                f"{report['queries']} queries, recall@{report['limit']}"
+            )
+            print(f"exact: {report['exact_ms_per_query']:.2f} ms/query")
+            for run in report["runs"]:
+                print(
+                    f"nprobe={run['nprobe']}: recall {run['recall']:.3f}, "
+                    f"{run['ms_per_query']:.2f} ms/query"
+                )
+        case "quantization_benchmark":
+            report = quantization_benchmark_command(args.limit, args.queries)
+            print(
+                f"{report['chunks']} chunks, {report['queries']} queries, "
+                f"recall@{report['limit']}"
+            )
+            print(
+                f"exact: {report['exact_bytes'] / 2**20:.1f} MiB, "
+                f"{report['exact_ms_per_query']:.2f} ms/query"
+            )
+            for run in report["runs"]:
+                print(
+                    f"{run['method']}: {run['bytes'] / 2**20:.1f} MiB "
+                    f"({report['exact_bytes'] / run['bytes']:.1f}x smaller), "
+                    f"recall {run['recall']:.3f}, {run['ms_per_query']:.2f} ms/query"
+                )
+        case "batch_benchmark":
+            report = micro_batch_benchmark_command(
+                args.threads, args.queries, args.max_batch, args.wait_ms
+            )
+            print(
+                f"{report['queries']} queries from {report['threads']} threads, "
+                f"batches of up to {report['max_batch_size']} "
+                f"within {report['max_wait_ms']} ms"
+            )
+            print(f"one at a time: {report['direct_qps']:.1f} queries/s")
+            print(
+                f"micro-batched: {report['batched_qps']:.1f} queries/s, "
+                f"{report['mean_batch_size']:.1f} queries per batch"
+            )
+            print(
+                f"through the query cache: {report['cache_mismatches']} of "
+                f"{report['cached_embeddings']} embeddings wrong"
+            )
+        case "backend_benchmark":
+            report = backend_benchmark_command(
+                args.limit, args.queries, args.onnx_threads
+            )
+            print(f"{report['queries']} queries, recall@{report['limit']} vs torch")
+            for run in report["runs"]:
+                print(
+                    f"{run['backend']}: encode {run['encode_ms']:.2f} ms/query, "
+                    f"min cosine {run['min_cosine']:.4f}, recall {run['recall']:.3f}; "
+                    f"rerank {run['rerank_ms']:.2f} ms/query, "
+                    f"rank correlation {run['rank_correlation']:.3f}"
+                )
+            for stats in report["models"]:
+                print(
+                    f"{stats['kind']} {stats['name']} ({stats['backend']}): "
+                    f"loaded in {stats['load_seconds']:.2f} s, "
+                    f"{stats['resident_bytes'] / 2**20:.1f} MiB resident"
+                )
         case _:
             parser.print_help()
 
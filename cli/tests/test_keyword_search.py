@@ -0,0 +1,231 @@
+import random
+
+import pytest
+from lib import keyword_search
+from lib.boolean_query import has_boolean_syntax
+from lib.keyword_search import InvertedIndex, search_command, tokenize_text
+
+MOVIES = [
+    {"id": 1, "title": "Star Quest", "description": "A crew races across the stars."},
+    {"id": 2, "title": "Bear Country", "description": "A bear guards the forest."},
+    {"id": 3, "title": "Night Train", "description": "Strangers meet on a train."},
+]
+
+
+WORDS = [
+    "space",
+    "crew",
+    "ship",
+    "planet",
+    "alien",
+    "war",
+    "love",
+    "city",
+    "night",
+    "train",
+    "river",
+    "king",
+    "queen",
+    "ghost",
+    "house",
+    "forest",
+    "bear",
+    "wolf",
+    "storm",
+    "island",
+    "secret",
+    "heist",
+    "detective",
+    "robot",
+    "dragon",
+    "school",
+    "summer",
+    "winter",
+    "family",
+    "road",
+    "escape",
+]
+
+
+def random_movies(count: int, first_id: int = 1, seed: int = 0) -> list[dict]:
+    """Movies whose words follow a skewed distribution, so scores vary."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+    def text(length: int) -> str:
+        return " ".join(rng.choices(WORDS, weights, k=length))
+
+    return [
+        {
+            "id": doc_id,
+            "title": text(rng.randint(1, 3)),
+            "description": f"the {text(rng.randint(3, 40))}",
+        }
+        for doc_id in range(first_id, first_id + count)
+    ]
+
+
+def random_queries(count: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(1, 4))) for _ in range(count)]
+
+
+@pytest.fixture
+def corpus(monkeypatch, tmp_path):
+    """Point the index at `tmp_path` and at movies set through the fixture."""
+    movies = []
+    monkeypatch.setattr(keyword_search, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(keyword_search, "load_movies", lambda: movies)
+    monkeypatch.setattr(keyword_search, "load_stopwords", lambda: ["a", "the"])
+    keyword_search.get_analyzer.cache_clear()
+    yield movies
+    keyword_search.get_analyzer.cache_clear()
+
+
+@pytest.fixture
+def index(corpus):
+    corpus.extend(MOVIES)
+    idx = InvertedIndex()
+    idx.build()
+    return idx
+
+
+def build_index(corpus: list[dict], movies: list[dict], **kwargs) -> InvertedIndex:
+    corpus[:] = movies
+    idx = InvertedIndex()
+    idx.build(**kwargs)
+    return idx
+
+
+def assert_same_rankings(actual: InvertedIndex, expected: InvertedIndex) -> None:
+    for query in random_queries(100):
+        for limit in (1, 10, 1000):
+            assert actual.bm25_rank(query, limit) == expected.bm25_rank(query, limit)
+
+
+@pytest.mark.parametrize("query", ["the", "zzz"])
+def test_bm25_rank_batch_without_hits(index, query):
+    # a stopword or an unknown word leaves no query term in the index
+    assert index.bm25_rank_batch([query], 10) == [index.bm25_rank(query, 10)]
+
+
+def test_bm25_rank_batch_matches_bm25_rank(index):
+    queries = ["bear", "zzz", "star train", "the"]
+    expected = [index.bm25_rank(query, 2) for query in queries]
+    assert index.bm25_rank_batch(queries, 2) == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [("NOT the", [1, 2, 3]), ("NOT (a OR the)", [1, 2, 3]), ("bear AND NOT the", [2])],
+)
+def test_boolean_match_negated_stopword_excludes_nothing(index, query, expected):
+    matches = [index.doc_ids[ordinal] for ordinal in index.boolean_match(query)]
+    assert matches == expected
+
+
+@pytest.mark.parametrize(
+    "query", ["Night Train (1999)", "Night Train (1999", "(train)"]
+)
+def test_search_parentheses_alone_are_not_boolean(index, monkeypatch, query):
+    monkeypatch.setattr(InvertedIndex, "load", lambda self: self.build())
+    assert not has_boolean_syntax(query)
+    assert [doc["id"] for doc in search_command(query)] == [3]
+
+
+@pytest.mark.parametrize("limit", [1, 3, 10, 100, 1000])
+def test_pruned_bm25_matches_exhaustive(corpus, limit):
+    idx = build_index(corpus, random_movies(500))
+    for query in [*random_queries(100), "the", "zzz", "space zzz"]:
+        exhaustive = idx.bm25_rank(query, limit, "exhaustive")
+        assert idx.bm25_rank(query, limit, "pruned") == exhaustive
+
+
+def test_pruned_bm25_matches_exhaustive_after_updates(corpus):
+    idx = build_index(corpus, random_movies(300))
+    for doc_id in range(1, 300, 7):
+        idx.delete_document(doc_id)
+    for doc in random_movies(60, first_id=1000, seed=2):
+        idx.add_document(doc)
+    for query in random_queries(100):
+        for limit in (1, 10, 100):
+            exhaustive = idx.bm25_rank(query, limit, "exhaustive")
+            assert idx.bm25_rank(query, limit, "pruned") == exhaustive
+
+
+def test_delta_segments_and_merge_match_fresh_build(corpus):
+    movies = random_movies(300)
+    idx = build_index(corpus, movies, positions=True)
+    idx.save()
+
+    deleted = set(range(5, 300, 11))
+    updated = {
+        doc["id"]: doc
+        for doc in random_movies(20, first_id=3, seed=3)
+        if doc["id"] not in deleted
+    }
+    added = random_movies(40, first_id=1000, seed=4)
+    for doc_id in sorted(deleted):
+        idx.delete_document(doc_id)
+    idx.save()
+    for doc in updated.values():
+        idx.update_document(doc)
+    idx.save()
+    for doc in added:
+        idx.add_document(doc)
+    idx.save()
+
+    # survivors keep their order; updated documents move to where they were
+    # re-added
+    live = [
+        doc for doc in movies if doc["id"] not in deleted and doc["id"] not in updated
+    ]
+    fresh = build_index(corpus, [*live, *updated.values(), *added], positions=True)
+
+    reloaded = InvertedIndex()
+    reloaded.load()
+    assert len(reloaded.delta_segments) == 3
+    assert_same_rankings(reloaded, fresh)
+
+    reloaded.merge()
+    assert_same_rankings(reloaded, fresh)
+    assert list(reloaded.doc_ids) == list(fresh.doc_ids)
+    assert list(reloaded.terms) == list(fresh.terms)
+    for term in fresh.terms:
+        assert reloaded.get_documents(term) == fresh.get_documents(term)
+    for query in random_queries(50, seed=5):
+        assert reloaded.proximity_rank(query, 20) == fresh.proximity_rank(query, 20)
+
+
+def test_phrase_search_finds_exactly_the_phrase(corpus):
+    movies = random_movies(300)
+    idx = build_index(corpus, movies, positions=True)
+    doc_texts = {doc["id"]: f"{doc['title']} {doc['description']}" for doc in movies}
+    doc_tokens = {doc_id: tokenize_text(text) for doc_id, text in doc_texts.items()}
+    rng = random.Random(6)
+    for _ in range(100):
+        words = rng.choice(list(doc_texts.values())).split()
+        start = rng.randrange(len(words) - 1)
+        query = " ".join(words[start : start + rng.randint(2, 3)])
+        phrase = tokenize_text(query)
+        expected = {
+            doc_id
+            for doc_id, tokens in doc_tokens.items()
+            if any(
+                tokens[i : i + len(phrase)] == phrase
+                for i in range(len(tokens) - len(phrase) + 1)
+            )
+        }
+        ranked = idx.proximity_rank(query, len(movies), phrase=True)
+        assert expected
+        assert {doc_id for doc_id, _ in ranked} == expected
+
+
+def test_sharded_build_matches_serial_build(corpus):
+    serial = build_index(corpus, random_movies(300), positions=True)
+    sharded = InvertedIndex()
+    sharded.build(workers=3, positions=True, min_parallel_docs=0)
+    assert list(sharded.terms) == list(serial.terms)
+    assert sharded.postings == serial.postings
+    assert sharded.positions == serial.positions
+    assert sharded.doc_norms == serial.doc_norms